@@ -1,23 +1,23 @@
 # app.py
 import os
-import io
-import re
 import json
-import time
 import base64
-import unicodedata
 from pathlib import Path
-from datetime import datetime
 
 import pandas as pd
-import requests
 import streamlit as st
-from openpyxl import load_workbook
-from openpyxl.utils import column_index_from_string
 
 # =============== Config página / estilo ===============
 st.set_page_config(page_title="Carga SIOT", page_icon="📤", layout="wide")
 
+# Después de set_page_config: el pipeline lee `st.secrets` al importarse
+from siot_pipeline import (
+    PIPEFY_TOKEN, PIPE_ID, DEDUP_KEY_COLUMNS, UPLOAD_UI_REFRESH_SEC,
+    UploadJob, build_titles, find_existing_cards, get_form_schema, get_form_schema_cache, get_labels_cache,
+    get_metrics, get_upload_journal, get_upload_worker, prepare_upload, prepared_row_keys,
+    run_streaming_upload_job, schema_warnings, select_rows,
+)
+
 # ---- Estilos (Arial + botón naranja + uploader beige) ----
 st.markdown("""
 <style>
@@ -97,6 +97,8 @@ def render_logo_sidebar(width_px: int = 160):
 
 # =============== Auth simple ===============
 AUTH_USERS = json.loads(os.environ.get("AUTH_USERS_JSON", os.getenv("AUTH_USERS_JSON", '{"admin":"admin"}')))
+# Usuarios que ven el panel de métricas
+ADMIN_USERS = set(json.loads(os.environ.get("ADMIN_USERS_JSON", '["admin"]')))
 
 def login_view():
     _, c, _ = st.columns([1,1,1])
@@ -127,314 +129,171 @@ def logout_button():
             st.session_state.pop("auth_user", None)
             st.rerun()
 
-# =============== Secrets / Pipefy ===============
-PIPEFY_API_URL = "https://api.pipefy.com/graphql"
-def get_secret(name, default=None):
-    try: return st.secrets[name]
-    except Exception: return os.getenv(name, default)
-
-PIPEFY_TOKEN = get_secret("PIPEFY_TOKEN", "")
-PIPE_ID      = int(str(get_secret("PIPEFY_PIPE_ID", "0")) or "0")
-
-# =============== Normalización de columnas ===============
-def _strip_accents(s: str) -> str:
-    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
-
-def _normalize_key(s: str) -> str:
-    """Normaliza encabezados: quita paréntesis, saltos de línea, asteriscos y tildes."""
-    if s is None:
-        return ""
-    s = str(s)
-    s = s.replace("\n", " ")                 # quita salto de línea
-    s = re.sub(r"\(.*?\)", "", s)            # quita '(...)'
-    s = s.replace("*", " ")                  # quita asteriscos
-    s = _strip_accents(s)                    # sin tildes
-    s = re.sub(r"[^A-Z0-9/ ]", " ", s.upper())  # deja letras/números/espacio y '/'
-    s = re.sub(r"\s+", " ", s).strip()       # colapsa espacios
-    return s
-
-# -------- Mapa de alias -> nombre canónico (los que usa el envío a Pipefy) --------
-ALIASES = {
-    "EMPRESA": ["EMPRESA"],
-
-    "CCU": [
-        "CCU",
-        "CCU COORDINADOR DE CUADRILLA NOMBRE APELLIDO",
-        "COORDINADOR DE CUADRILLA",
-        "NOMBRE COORDINADOR",
-        "CCU NOMBRE APELLIDO",
-    ],
-
-    "INTEGRANTES DE CUADRILLA": [
-        "INTEGRANTES DE CUADRILLA",
-        "INTEGRANTES DEL EQUIPO DE CUADRILLA",
-        "INTEGRANTES DEL EQUIPO DE CUADRILLA NOMBRE APELLIDO - NUMERO DE CEDULA",
-    ],
-
-    "CONTACTO CCU": [
-        "CONTACTO CCU",
-        "TELEFONO DE CONTACTO CCU",
-        "TELEFONO COORDINADOR",
-    ],
-
-    # ← canónico para email
-    "CORREO DEL SOLICITANTE": [
-        "CORREO DEL SOLICITANTE",
-        "CORREO ELECTRONICO DEL SOLICITANTE",
-        "EMAIL", "E MAIL", "CORREO ELECTRONICO",
-    ],
-
-    "FECHA DE INICIO": ["FECHA DE INICIO", "FECHA INICIO", "INICIO FECHA"],
-    "FECHA DE FIN":    ["FECHA DE FIN", "FECHA FIN", "FIN FECHA"],
-    "HORA DE INICIO":  ["HORA DE INICIO", "HORA INICIO", "INICIO HORA"],
-    "HORA DE FIN":     ["HORA DE FIN", "HORA FIN", "FIN HORA"],
-
-    "CANTÓN / ESTACIÓN": ["CANTON / ESTACION", "CANTON", "ESTACION", "CANTON / ESTACION"],
-
-    # plural → canónico singular
-    "ZONA DE ESTACIÓN": ["ZONA DE ESTACION", "ZONAS DE ESTACION", "ZONAS DE ESTACION "],
-
-    "CATEGORÍA DE TRABAJOS": ["CATEGORIA DE TRABAJOS"],
-    "TIPO DE MANTENIMIENTO / INSPECCIÓN": [
-        "TIPO DE MANTENIMIENTO / INSPECCION",
-        "TIPO DE MANTENIMIENTO", "TIPO DE INSPECCION",
-    ],
-
-    # con y sin "DE"
-    "N° REGISTRO DE FALLA": ["N° REGISTRO FALLA", "N REGISTRO FALLA", "NUMERO REGISTRO FALLA"],
-
-    "CATEGORÍA DE RIESGO": ["CATEGORIA DE RIESGO"],
-    "DESCRIPCIÓN DE ACTIVIDAD": ["DESCRIPCION DE ACTIVIDAD", "DESCRIPCION", "ACTIVIDAD"],
-    "DESENERGIZACIONES": ["DESENERGIZACIONES", "DESENERGIZACION"],
-
-    # con asterisco o “DE LA ZONA”
-    "VEHÍCULO": ["VEHICULO", "VEHICULOS", "VEHICULO "],
-    "ILUMINACIÓN PARCIAL": ["ILUMINACION PARCIAL", "ILUMINACION PARCIAL DE LA ZONA"],
-    "SEÑALETICA PROPIA": ["SENALETICA PROPIA", "SENHALETICA PROPIA", "SEÑALÉTICA PROPIA"],
-
-    "R1": ["R1"], "R2": ["R2"], "P1": ["P1"], "P3": ["P3"], "E1": ["E1"], "V3": ["V3"],
-    "P6": ["P6"], "P7": ["P7"], "P8": ["P8"],
-
-    "BLOQUEO DE VÍA": ["BLOQUEO DE VIA", "BLOQUEO DE VÍA"],
-    "DESDE": ["DESDE"],
-    "HASTA": ["HASTA"],
-
-    "Seleccionar etiqueta": ["SELECCIONAR ETIQUETA", "ETIQUETA"],
-}
+def reload_labels_button():
+    with st.sidebar:
+        if st.button("🔄 Recargar etiquetas y formulario de Pipefy", use_container_width=True):
+            get_labels_cache().invalidate(PIPE_ID)
+            get_form_schema_cache().invalidate(PIPE_ID)
+            st.toast("Etiquetas y formulario se recargarán en la próxima consulta.")
+
+# =============== Panel de métricas (admin) ===============
+def metrics_toggle() -> bool:
+    if st.session_state.get("auth_user") not in ADMIN_USERS: return False
+    with st.sidebar:
+        return st.toggle("📊 Panel de métricas", value=False)
+
+def render_metrics_panel():
+    m = get_metrics()
+    snap = m.snapshot()
+    cards = {c["labels"].get("result"): int(c["value"]) for c in snap["counters"] if c["name"] == "siot_cards_total"}
+    fases = m.phase_summary()
+    subida = next((f for f in fases if f["fase"] == "upload"), None)
+    with st.expander("📊 Métricas del servidor", expanded=True):
+        st.caption(f"Desde {snap['started_at']} · {snap['uptime_s'] / 60:.0f} min")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Tarjetas creadas", cards.get("created", 0))
+        c2.metric("Tarjetas con error", cards.get("failed", 0))
+        c3.metric("Tarjetas/s (subida)", subida["filas_por_s"] if subida and subida["filas_por_s"] else "—")
+        st.markdown("**Fases**")
+        st.dataframe(pd.DataFrame(fases), use_container_width=True, hide_index=True)
+        st.markdown("**Llamadas a Pipefy**")
+        st.dataframe(pd.DataFrame(m.http_summary()), use_container_width=True, hide_index=True)
+        d1, d2, d3 = st.columns(3)
+        d1.download_button("⬇️ JSON", json.dumps(snap, ensure_ascii=False, indent=2),
+                           file_name="siot_metrics.json", mime="application/json", use_container_width=True)
+        d2.download_button("⬇️ Prometheus", m.to_prometheus(), file_name="siot_metrics.prom",
+                           mime="text/plain", use_container_width=True)
+        if d3.button("♻️ Reiniciar métricas", use_container_width=True):
+            m.reset()
+            st.rerun()
 
-def apply_aliases(df: pd.DataFrame) -> pd.DataFrame:
-    if df.empty: return df
-    norm_cols = {_normalize_key(c): c for c in df.columns}
-    rename_map = {}
-    for canon, variants in ALIASES.items():
-        for v in (variants + [canon]):  # intentamos variantes + el canónico
-            vn = _normalize_key(v)
-            if vn in norm_cols:
-                rename_map[norm_cols[vn]] = canon
-                break
-    if rename_map:
-        df = df.rename(columns=rename_map)
-    return df
-
-# =============== Utilidades de Excel ===============
-def read_excel_table_siot(uploaded_bytes: bytes, table_name: str = "SIOT") -> pd.DataFrame:
-    """Lee la tabla SIOT; si no existe, fallback por encabezado flexible."""
-    bio = io.BytesIO(uploaded_bytes)
-    wb = load_workbook(bio, data_only=True, read_only=False)
-
-    # 1) Intentar tabla SIOT
-    for ws in wb.worksheets:
-        tables = ws.tables or {}
-        for t in tables.values():
-            if (t.name or "").strip().lower() == table_name.lower():
-                start, end = t.ref.split(":")
-                start_col = ''.join(filter(str.isalpha, start))
-                start_row = int(''.join(filter(str.isdigit, start)))
-                end_col = ''.join(filter(str.isalpha, end))
-                end_row = int(''.join(filter(str.isdigit, end)))
-                min_col = column_index_from_string(start_col)
-                max_col = column_index_from_string(end_col)
-                data = []
-                for r in ws.iter_rows(min_row=start_row, max_row=end_row,
-                                      min_col=min_col, max_col=max_col, values_only=True):
-                    data.append(list(r))
-                if not data: return pd.DataFrame()
-                header = [str(h).strip() if h is not None else "" for h in data[0]]
-                body = data[1:]
-                df = pd.DataFrame(body, columns=header)
-                df = df.loc[:, [c for c in df.columns if str(c).strip() and not str(c).startswith("Unnamed")]]
-                for c in df.columns:
-                    if df[c].dtype == object:
-                        df[c] = df[c].apply(lambda x: x.strip() if isinstance(x, str) else x)
-                return df.dropna(how="all")
-
-    # 2) Fallback: detectar encabezado por EMPRESA (o similares)
-    bio.seek(0)
-    raw = pd.read_excel(bio, engine="openpyxl", sheet_name=0, header=None)
-    header_row = None
-    for i in range(min(60, len(raw))):
-        vals = [str(x).strip().upper() if pd.notna(x) else "" for x in raw.iloc[i].tolist()]
-        # si alguna celda parece EMPRESA (según alias)
-        if any(_normalize_key(v) in [_normalize_key(a) for a in ALIASES.get("EMPRESA", ["EMPRESA"])] for v in vals):
-            header_row = i
-            break
-    if header_row is None: return pd.DataFrame()
-    headers = [str(c).strip() if pd.notna(c) else "" for c in raw.iloc[header_row].tolist()]
-    df = raw.iloc[header_row+1:].copy()
-    df.columns = headers
-    df = df.loc[:, [c for c in df.columns if c and not str(c).startswith("Unnamed")]]
-    for c in df.columns:
-        if df[c].dtype == object:
-            df[c] = df[c].apply(lambda x: x.strip() if isinstance(x, str) else x)
-    return df.dropna(how="all")
-
-# =============== Utilidades de campos/fechas/labels ===============
-def _fmt_date(val):
-    if val is None: return None
-    try:
-        if isinstance(val, float) and pd.isna(val): return None
-    except Exception: pass
-    if hasattr(val, "strftime"):
-        return val.strftime("%Y-%m-%d")
-    s = str(val).strip()
-    if not s or s.lower() == "nan": return None
-    for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y"):
-        try: return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
-        except Exception: pass
-    return s
-
-def _add_field(fields, field_id, value):
-    if value is None: return
-    try:
-        if isinstance(value, float) and pd.isna(value): return
-    except Exception: pass
-    s = str(value).strip()
-    if not s or s.lower() == "nan": return
-    fields.append({"field_id": field_id, "field_value": s})
-
-def _parse_multi(val):
-    if val is None: return None
-    try:
-        if isinstance(val, float) and pd.isna(val): return None
-    except Exception: pass
-    if isinstance(val, (list, tuple, set)):
-        out = [str(x).strip() for x in val if str(x).strip() not in ("", "nan")]
-        return out or None
-    s = str(val).strip()
-    if not s or s.lower() == "nan": return None
-    return [p.strip() for p in s.replace(",", ";").split(";") if p.strip()] or None
-
-def _add_field_list(fields, field_id, value):
-    items = _parse_multi(value)
-    if items:
-        fields.append({"field_id": field_id, "field_value": items})
-
-def _fetch_labels_map(token: str, pipe_id: int) -> dict:
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    q = {"query": "query($id: ID!){ pipe(id:$id){ labels{ id name } } }", "variables": {"id": pipe_id}}
-    try:
-        r = requests.post(PIPEFY_API_URL, headers=headers, json=q, timeout=30)
-        if r.status_code != 200: return {}
-        data = r.json().get("data", {}).get("pipe", {}).get("labels", [])
-        return {x["name"]: x["id"] for x in data if "id" in x and "name" in x}
-    except Exception:
-        return {}
-
-def _add_label_select(fields, field_id, value, labels_map, report_missing):
-    items = _parse_multi(value)
-    if not items: return
-    ids = []
-    for name in items:
-        name = str(name).strip()
-        if not name: continue
-        if name in labels_map: ids.append(labels_map[name])
-        else: report_missing.append(name)
-    if ids:
-        fields.append({"field_id": field_id, "field_value": ids})
-
-def pipefy_create_card(token: str, pipe_id: int, fields_attrs: list, title: str):
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    mutation = {
-        "query": """
-        mutation($input: CreateCardInput!) {
-          createCard(input: $input) { card { id title } }
-        }
-        """,
-        "variables": {"input": {"pipe_id": pipe_id, "title": title, "fields_attributes": fields_attrs}},
-    }
-    try:
-        resp = requests.post(PIPEFY_API_URL, headers=headers, json=mutation, timeout=40)
-        if resp.status_code != 200:
-            return False, f"HTTP {resp.status_code}: {resp.text}"
-        data = resp.json()
-        if "errors" in data: return False, str(data["errors"])
-        return True, data.get("data", {}).get("createCard", {}).get("card", {}).get("id")
-    except Exception as e:
-        return False, str(e)
-
-# =============== Reglas de obligatoriedad ===============
-REQUIRED_COLS = [
-    "CCU",
-    "INTEGRANTES DE CUADRILLA",
-    "CONTACTO CCU",
-    "ZONA DE ESTACIÓN",
-    "FECHA DE INICIO",
-    "FECHA DE FIN",
-    "HORA DE INICIO",
-    "HORA DE FIN",
-    "N° REGISTRO DE FALLA",
-    "VEHÍCULO",
-    "ILUMINACIÓN PARCIAL",
-    "SEÑALETICA PROPIA",
-    "CORREO DEL SOLICITANTE",
-]
+# =============== Panel de trabajos ===============
+ERRORS_PREVIEW_ROWS = 500  # filas de error mostradas en pantalla; el detalle completo va en la descarga
+
+def _render_job_errors(job: UploadJob):
+    """Un solo bloque de errores (resumen por estado + tabla acotada + descargas),
+    sin importar cuántas filas fallaron."""
+    errores, csv_bytes, xlsx_bytes = job.errors_exports()
+    if errores.empty: return
+    st.error(f"❌ {len(errores)} filas no se subieron.")
+    por_estado = errores["estado_http"].astype(object).where(errores["estado_http"].notna(), "sin respuesta")
+    st.dataframe(por_estado.value_counts().rename_axis("estado_http").reset_index(name="filas"),
+                 hide_index=True)
+    if len(errores) > ERRORS_PREVIEW_ROWS:
+        st.caption(f"Mostrando {ERRORS_PREVIEW_ROWS} de {len(errores)}; descarga el detalle completo.")
+    st.dataframe(errores.head(ERRORS_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+    stem = Path(job.filename).stem
+    d1, d2 = st.columns(2)
+    d1.download_button("⬇️ Errores (CSV)", csv_bytes,
+                       file_name=f"{stem}_errores.csv", mime="text/csv", use_container_width=True)
+    d2.download_button("⬇️ Errores (Excel)", xlsx_bytes, file_name=f"{stem}_errores.xlsx",
+                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                       use_container_width=True)
+
+def _render_stream_report(job: UploadJob):
+    """Lo que el modo normal muestra antes de subir (faltantes, fechas, omitidas), al final."""
+    st.caption(f"Filas leídas {job.rows_read} · ya subidas antes {job.skipped_done} · "
+               f"existentes en el Pipe {len(job.skipped_existing)} · enviadas {job.queued}")
+    if job.invalid_rows:
+        st.warning(f"{len(job.invalid_rows)} filas con **campos obligatorios** vacíos no se subieron:")
+        st.dataframe(pd.DataFrame(job.invalid_rows[:ERRORS_PREVIEW_ROWS]), use_container_width=True, hide_index=True)
+    if job.rejected:
+        st.warning(f"{len({r['fila'] for r in job.rejected})} filas tienen valores que el formulario de Pipefy "
+                   "rechazaría y no se subieron:")
+        st.dataframe(pd.DataFrame(job.rejected[:ERRORS_PREVIEW_ROWS]), use_container_width=True, hide_index=True)
+    if job.unparsed:
+        st.warning("Estas fechas/horas no se pudieron interpretar y se enviaron tal cual:")
+        st.dataframe(pd.DataFrame(job.unparsed[:ERRORS_PREVIEW_ROWS]), use_container_width=True, hide_index=True)
+
+def _render_job(job: UploadJob):
+    st.markdown(f"**{job.filename}** · `{job.id}`")
+    frac = min(1.0, job.processed / job.total) if job.total else (0.0 if job.active else 1.0)
+    st.progress(frac, text=f"Procesadas {job.processed}/{job.total}" if job.active else "Terminado")
+    if job.active:
+        # Durante la subida solo contadores: el detalle de errores se arma al terminar
+        st.caption(f"Creadas {job.creadas} · Errores {job.errores}")
+        return
+    if job.status == "failed":
+        st.error(f"❌ El trabajo se detuvo: {job.message}")
+    if job.missing_labels:
+        st.warning("Estas etiquetas NO existen en el Pipe y se omitieron: " + ", ".join(sorted(job.missing_labels)))
+    if job.streaming: _render_stream_report(job)
+    _render_job_errors(job)
+    st.success(f"✅ Terminado. Tarjetas creadas: {job.creadas} • Errores: {job.errores}")
+
+@st.fragment(run_every=UPLOAD_UI_REFRESH_SEC)
+def _render_job_live(job_id: str):
+    job = get_upload_worker().get(job_id)
+    if job is None: return
+    _render_job(job)
+    if not job.active: st.rerun()  # al terminar se redibuja la página completa (y deja de consultar)
+
+def current_upload_job() -> UploadJob | None:
+    """Trabajo de la sesión; si la sesión es nueva, el último activo del usuario."""
+    worker = get_upload_worker()
+    job = worker.get(st.session_state.get("upload_job", ""))
+    if job is None:
+        job = next((j for j in worker.jobs_for(st.session_state.get("auth_user")) if j.active), None)
+        if job is not None: st.session_state["upload_job"] = job.id
+    return job
+
+def render_upload_jobs():
+    """Muestra el trabajo de la sesión y consulta su avance sin bloquear la página."""
+    job = current_upload_job()
+    if job is None: return
+    st.subheader("📦 Subida en curso" if job.active else "📦 Última subida")
+    if job.active: _render_job_live(job.id)
+    else: _render_job(job)
 
 # =============== APP ===============
 if require_auth():
     render_logo_sidebar(150)
     logout_button()
+    reload_labels_button()
+    ver_metricas = metrics_toggle()
 
     render_logo_center(220)
     st.title("INSTRUCCIÓN OPERACIONAL DE TRABAJOS")
+    if ver_metricas: render_metrics_panel()
 
     if not PIPEFY_TOKEN or not PIPE_ID:
         st.error("Faltan credenciales en `st.secrets`: agrega `PIPEFY_TOKEN` y `PIPEFY_PIPE_ID`.")
         st.stop()
 
+    render_upload_jobs()
+    job_activo = current_upload_job()
+    ocupado = job_activo is not None and job_activo.active
+
     up = st.file_uploader("Sube tu Excel (.xlsx) con la tabla **SIOT**", type=["xlsx"])
+    streaming = st.toggle("⚡ Modo streaming (subir mientras se lee, sin vista previa)", value=False,
+                          help="Para libros muy grandes: las primeras tarjetas salen tras leer el primer bloque. "
+                               "Faltantes y fechas no interpretadas se informan al terminar.")
+
+    if up is not None and streaming:
+        st.info(f"📄 {up.name} · {up.size / 1e6:.1f} MB. Se leerá y subirá por bloques; "
+                "las filas ya subidas a este Pipe se omiten.")
+        omitir_existentes = st.checkbox("🔍 Omitir filas que ya existen como tarjetas en el Pipe", value=False,
+                                        help="Clave: " + " + ".join(DEDUP_KEY_COLUMNS))
+        if ocupado:
+            st.info("⏳ Hay una subida en curso; espera a que termine para enviar de nuevo.")
+        if st.button("🚀 Subir a Pipefy (streaming)", type="primary", use_container_width=True, disabled=ocupado):
+            job = UploadJob(st.session_state["auth_user"], PIPE_ID, up.name, 0)
+            get_upload_worker().submit(job, PIPEFY_TOKEN, up.getvalue(), get_upload_journal(), "SIOT", False,
+                                       omitir_existentes, target=run_streaming_upload_job)
+            st.session_state["upload_job"] = job.id
+            st.rerun()
 
-    if up is not None:
-        content = up.read()
-        df = read_excel_table_siot(content, "SIOT")
+    elif up is not None:
+        content = up.getvalue()
+        df, faltantes_por_fila, valid_mask, fechas_invalidas = prepare_upload(content, "SIOT")
 
         if df.empty:
             st.error("No se logró leer datos de la tabla **SIOT** ni por fallback de encabezados.")
             st.stop()
 
-        # Renombrar columnas usando alias/normalización
-        df = apply_aliases(df)
-
-        # Cortar hasta última fila con EMPRESA no vacía (si existe la columna)
-        if "EMPRESA" in df.columns:
-            mask_emp = df["EMPRESA"].astype(str).str.strip().replace({"None": "", "nan": ""}) != ""
-            if mask_emp.any():
-                df = df.loc[df.index.min(): df.index[mask_emp].max()].copy()
-
         st.subheader("👀 Vista previa")
         st.dataframe(df.head(50), use_container_width=True)
 
-        # === Validación de obligatorios (por fila) ===
-        faltantes_por_fila = []
-        for idx, row in df.iterrows():
-            faltan = [c for c in REQUIRED_COLS if c in df.columns and (pd.isna(row.get(c)) or str(row.get(c)).strip() == "")]
-            if faltan:
-                faltantes_por_fila.append({"fila": int(idx)+1, "faltan": ", ".join(faltan)})
-
-        valid_mask = pd.Series(True, index=df.index)
-        for item in faltantes_por_fila:
-            i = item["fila"] - 1
-            if i in valid_mask.index: valid_mask.loc[i] = False
-
         df_validas = df[valid_mask].copy()
         df_invalidas = df[~valid_mask].copy()
 
@@ -445,76 +304,71 @@ if require_auth():
 
         if df_invalidas.shape[0] > 0:
             st.warning("Hay filas con **campos obligatorios** vacíos. No se subirán. Detalle:")
-            st.dataframe(pd.DataFrame(faltantes_por_fila), use_container_width=True)
+            st.dataframe(faltantes_por_fila, use_container_width=True)
+
+        if len(fechas_invalidas):
+            st.warning("Estas fechas/horas no se pudieron interpretar y se enviarán tal cual:")
+            st.dataframe(fechas_invalidas, use_container_width=True)
+
+        # ===== Estado previo según la bitácora =====
+        # Los avisos se dibujan en su lugar, pero la selección necesita antes los controles de abajo
+        journal = get_upload_journal()
+        aviso_previo = st.container()
+
+        # ===== Duplicados contra tarjetas ya existentes en el Pipe (opcional) =====
+        existentes, modo = None, None
+        if st.checkbox("🔍 Buscar duplicados en el Pipe antes de subir", value=False,
+                       help="Clave: " + " + ".join(DEDUP_KEY_COLUMNS)):
+            modo = st.radio("Filas duplicadas", ["Omitir", "Solo marcar"], horizontal=True)
+            try:
+                with st.spinner("Revisando tarjetas existentes…"):
+                    existentes = find_existing_cards(df_validas, PIPEFY_TOKEN, PIPE_ID)
+            except Exception as e:
+                st.warning(f"No se pudo verificar duplicados: {e}")
+        aviso_dup = st.container()
+
+        # ===== Pre-validación contra el formulario de inicio del Pipe =====
+        schema = get_form_schema(PIPEFY_TOKEN, PIPE_ID)
+        if schema is None:
+            st.warning("No se pudo leer el formulario de inicio del Pipe; se enviará sin pre-validar.")
+        else:
+            for aviso in schema_warnings(schema): st.caption(f"⚠️ {aviso}")
+        # El checkbox "Omitir filas rechazadas" se dibuja más abajo; su valor del rerun anterior vale aquí
+        sel = select_rows(df_validas, PIPE_ID, journal, keys=prepared_row_keys(content, PIPE_ID, "SIOT"),
+                          schema=schema, existentes=existentes, skip_existing=(modo == "Omitir"),
+                          skip_rejected=st.session_state.get("omitir_rechazadas", True))
+        if sel.rechazos is not None and len(sel.rechazos):
+            st.warning(f"{len(sel.rechazadas)} filas tienen valores que el formulario de Pipefy rechazaría. Detalle:")
+            st.dataframe(sel.rechazos.head(ERRORS_PREVIEW_ROWS), use_container_width=True, hide_index=True)
+            st.checkbox("Omitir filas rechazadas", value=True, key="omitir_rechazadas",
+                        help="Desmarca si el formulario cambió y quieres enviarlas igual.")
+
+        ya_subidas = sel.estados.count("done")
+        fallidas = sel.estados.count("failed")
+        if ya_subidas:
+            aviso_previo.info(f"ℹ️ {ya_subidas} filas de este archivo ya se subieron a este Pipe y se omitirán.")
+        if existentes is not None:
+            dup = sel.duplicados
+            if dup:
+                aviso_dup.warning(f"{len(dup)} filas ya existen como tarjetas en el Pipe"
+                                  + (" y no se subirán." if modo == "Omitir" else "."))
+                aviso_dup.dataframe(pd.DataFrame({"fila": [sel.filas[p] for p, _ in dup], "tarjeta": [c for _, c in dup]}),
+                                    use_container_width=True)
+            else:
+                aviso_dup.success("Sin duplicados en el Pipe.")
+        por_subir = len(sel.positions())
 
         # ===== Botón para subir SOLO filas válidas =====
-        if st.button(f"🚀 Subir a Pipefy ({len(df_validas)} tarjetas)", type="primary", use_container_width=True, disabled=(len(df_validas) == 0)):
-            labels_map = _fetch_labels_map(PIPEFY_TOKEN, PIPE_ID)
-            creadas = errores = 0
-            missing_labels = []
-
-            progress = st.progress(0.0, text="Iniciando…")
-            total = len(df_validas)
-
-            for i, (_, row) in enumerate(df_validas.iterrows(), start=1):
-                fields = []
-                # Texto/fecha/select
-                _add_field(fields, "empresa", row.get("EMPRESA"))
-                _add_field(fields, "ccu_1", row.get("CCU"))
-                _add_field(fields, "integrantes_de_cuadrilla", row.get("INTEGRANTES DE CUADRILLA"))
-                _add_field(fields, "contacto_coordinador_de_cuadrilla", row.get("CONTACTO CCU"))
-                _add_field(fields, "fecha_de_inicio", _fmt_date(row.get("FECHA DE INICIO")))
-                _add_field(fields, "fecha_de_fin", _fmt_date(row.get("FECHA DE FIN")))
-                _add_field(fields, "cant_n_estaci_n", row.get("CANTÓN / ESTACIÓN"))
-                _add_field(fields, "zona_de_trabajo", row.get("ZONA DE ESTACIÓN"))
-                _add_field(fields, "descripci_n_de_actividad", row.get("DESCRIPCIÓN DE ACTIVIDAD"))
-                _add_field(fields, "hora_de_inicio", row.get("HORA DE INICIO"))
-                _add_field(fields, "hora_de_fin", row.get("HORA DE FIN"))
-                _add_field(fields, "tipo_de_jornada", row.get("TIPO DE JORNADA"))
-                _add_field(fields, "tipo_de_mantenimiento", row.get("TIPO DE MANTENIMIENTO / INSPECCIÓN"))
-                _add_field(fields, "registro_de_incidente", row.get("N° REGISTRO DE FALLA"))
-                _add_field(fields, "categor_a_de_riesgo", row.get("CATEGORÍA DE RIESGO"))
-                _add_field(fields, "categor_a_de_trabajos", row.get("CATEGORÍA DE TRABAJOS"))
-                _add_field(fields, "desenergizaci_n", row.get("DESENERGIZACIONES"))
-
-                # Checklists / multiselect
-                _add_field_list(fields, "veh_culo", row.get("VEHÍCULO"))
-                _add_field_list(fields, "iluminaci_n_parcia", row.get("ILUMINACIÓN PARCIAL"))
-                _add_field_list(fields, "se_aletica_propia", row.get("SEÑALETICA PROPIA"))
-                _add_field_list(fields, "r1_1", row.get("R1"))
-                _add_field_list(fields, "r2_1", row.get("R2"))
-                _add_field_list(fields, "p1", row.get("P1"))
-                _add_field_list(fields, "p3", row.get("P3"))
-                _add_field_list(fields, "e1", row.get("E1"))
-                _add_field_list(fields, "v3", row.get("V3"))
-                _add_field_list(fields, "copy_of_se_aletica_propia", row.get("P6"))
-                _add_field_list(fields, "copy_of_r1", row.get("P7"))
-                _add_field_list(fields, "copy_of_p3", row.get("P8"))
-
-                # Bloqueo de vía
-                _add_field_list(fields, "bloqueo_de_v_a_1", row.get("BLOQUEO DE VÍA"))
-                _add_field(fields, "bloqueo_desde", row.get("DESDE"))
-                _add_field(fields, "hasta", row.get("HASTA"))
-
-                # Etiquetas (label_select)
-                _add_label_select(fields, "seleccionar_etiqueta", row.get("Seleccionar etiqueta"), labels_map, missing_labels)
-
-                # Email solicitante (canónico que definimos)
-                _add_field(fields, "correo_electr_nico_del_solicitante", row.get("CORREO DEL SOLICITANTE"))
-
-                title = str(row.get("EMPRESA") or f"Fila {i}")
-                ok, info = pipefy_create_card(PIPEFY_TOKEN, PIPE_ID, fields, title)
-                if ok:
-                    creadas += 1
-                else:
-                    errores += 1
-                    st.error(f"❌ Error en fila {i}: {info}")
-
-                time.sleep(0.05)
-                progress.progress(i/total, text=f"Procesadas {i}/{total}")
-
-            if missing_labels:
-                st.warning("Estas etiquetas NO existen en el Pipe y se omitieron: " + ", ".join(sorted(set(missing_labels))))
-            st.success(f"✅ Terminado. Tarjetas creadas: {creadas} • Errores: {errores}")
-
-
+        if ocupado:
+            st.info("⏳ Hay una subida en curso; espera a que termine para enviar de nuevo.")
+        subir = st.button(f"🚀 Subir a Pipefy ({por_subir} tarjetas)", type="primary", use_container_width=True, disabled=(por_subir == 0 or ocupado))
+        reintentar = fallidas > 0 and st.button(f"🔁 Reintentar solo filas fallidas ({fallidas})", use_container_width=True, disabled=ocupado)
+        if subir or reintentar:
+            # Posiciones (dentro de df_validas) a enviar: pendientes/fallidas, o solo fallidas
+            pos = sel.positions(retry_failed_only=reintentar)
+            titles = build_titles(df_validas)
+            job = UploadJob(st.session_state["auth_user"], PIPE_ID, up.name, len(pos))
+            get_upload_worker().submit(job, PIPEFY_TOKEN, df_validas.iloc[pos], [sel.keys[p] for p in pos],
+                                       [titles[p] for p in pos], [sel.filas[p] for p in pos], journal)
+            st.session_state["upload_job"] = job.id
+            st.rerun()
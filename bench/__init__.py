@@ -0,0 +1,2 @@
+# bench/__init__.py
+"""Benchmarks del pipeline SIOT (generador de libros, Pipefy falso y mediciones)."""
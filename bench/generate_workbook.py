@@ -0,0 +1,175 @@
+# bench/generate_workbook.py
+"""Generador de libros SIOT sintéticos para benchmarks.
+
+Crea un .xlsx con filas de título "basura" arriba, una tabla real llamada `SIOT` y
+encabezados tomados al azar entre las variantes de ALIASES (con saltos de línea,
+paréntesis y asteriscos como en las planillas reales).
+
+    python -m bench.generate_workbook --rows 10000 --out /tmp/siot_10k.xlsx
+"""
+import io
+import re
+import random
+import zipfile
+import argparse
+import warnings
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+EMPRESAS = ["CONSTRUCTORA ANDES", "ELECTROMEC S.A.", "VIAL NORTE", "SEÑALIZA CÍA. LTDA.", "METRO SERVICIOS"]
+NOMBRES = ["Ana Pérez", "Luis Gómez", "María Toapanta", "Jorge Núñez", "Carla Ruiz", "Diego Andrade"]
+ESTACIONES = ["Quitumbe", "Morán Valverde", "Solanda", "El Calzado", "La Magdalena", "San Francisco",
+              "La Alameda", "El Ejido", "Universidad Central", "La Carolina", "Iñaquito", "El Labrador"]
+ZONAS = ["ANDÉN", "VÍA", "CUARTO TÉCNICO", "MEZZANINE", "PATIO TALLERES"]
+CATEGORIAS = ["MANTENIMIENTO", "OBRA CIVIL", "INSPECCIÓN"]
+TIPOS_MANT = ["PREVENTIVO", "CORRECTIVO", "INSPECCIÓN"]
+RIESGOS = ["BAJO", "MEDIO", "ALTO"]
+VEHICULOS = ["Camioneta", "Camión", "Dresina", "Ninguno"]
+SI_NO = ["SI", "NO"]
+ETIQUETAS = ["URGENTE", "PROGRAMADO", "NOCTURNO", "NO EXISTE EN PIPE"]
+
+# Columna canónica -> generador de valor (recibe el Random)
+COLUMNS = {
+    "EMPRESA": lambda r: r.choice(EMPRESAS),
+    "CCU": lambda r: r.choice(NOMBRES),
+    "INTEGRANTES DE CUADRILLA": lambda r: ", ".join(r.sample(NOMBRES, 3)),
+    "CONTACTO CCU": lambda r: f"09{r.randint(10000000, 99999999)}",
+    "CORREO DEL SOLICITANTE": lambda r: f"solicitante{r.randint(1, 50)}@metro.example",
+    "FECHA DE INICIO": lambda r: _fecha(r),
+    "FECHA DE FIN": lambda r: _fecha(r),
+    "HORA DE INICIO": lambda r: r.choice(["22:00", "23:30", "00:15", "8:00 PM"]),
+    "HORA DE FIN": lambda r: r.choice(["04:00", "04:30", "05:00"]),
+    "CANTÓN / ESTACIÓN": lambda r: r.choice(ESTACIONES),
+    "ZONA DE ESTACIÓN": lambda r: r.choice(ZONAS),
+    "CATEGORÍA DE TRABAJOS": lambda r: r.choice(CATEGORIAS),
+    "TIPO DE MANTENIMIENTO / INSPECCIÓN": lambda r: r.choice(TIPOS_MANT),
+    "N° REGISTRO DE FALLA": lambda r: r.randint(1000, 99999),  # celda numérica
+    "CATEGORÍA DE RIESGO": lambda r: r.choice(RIESGOS),
+    "DESCRIPCIÓN DE ACTIVIDAD": lambda r: "Revisión de " + r.choice(["catenaria", "desvío", "escaleras", "señales"]),
+    "DESENERGIZACIONES": lambda r: r.choice(SI_NO),
+    "VEHÍCULO": lambda r: "; ".join(r.sample(VEHICULOS, r.randint(1, 2))),
+    "ILUMINACIÓN PARCIAL": lambda r: r.choice(SI_NO),
+    "SEÑALETICA PROPIA": lambda r: r.choice(SI_NO),
+    "R1": lambda r: r.choice(SI_NO), "R2": lambda r: r.choice(SI_NO), "P1": lambda r: r.choice(SI_NO),
+    "BLOQUEO DE VÍA": lambda r: r.choice(SI_NO),
+    "DESDE": lambda r: r.choice(ESTACIONES),
+    "HASTA": lambda r: r.choice(ESTACIONES),
+    "Seleccionar etiqueta": lambda r: r.choice(ETIQUETAS),
+}
+
+# Encabezados "como vienen en el Excel" para algunas columnas (además de ALIASES)
+DECORATED = {
+    "CCU": "CCU (Coordinador de cuadrilla)\nNombre Apellido",
+    "INTEGRANTES DE CUADRILLA": "INTEGRANTES DEL EQUIPO DE CUADRILLA (Nombre Apellido - Número de cédula)",
+    "VEHÍCULO": "VEHÍCULO *",
+    "ZONA DE ESTACIÓN": "ZONAS DE ESTACIÓN",
+}
+
+# Columnas que `missing_ratio` deja vacías: obligatorias de texto y una numérica (así
+# algunos bloques la leen con vacíos y otros no)
+_MISSING_COLS = list(range(1, 9)) + [list(COLUMNS).index("N° REGISTRO DE FALLA")]
+
+_BASE_DATE = datetime(2024, 1, 1)
+
+def _fecha(r: random.Random):
+    d = _BASE_DATE + timedelta(days=r.randint(0, 365))
+    # Mezcla realista: celdas fecha, texto dd/mm/aaaa y algún serial de Excel
+    k = r.random()
+    if k < 0.6: return d
+    if k < 0.95: return d.strftime("%d/%m/%Y")
+    return (d - datetime(1899, 12, 30)).days
+
+def _headers(r: random.Random, aliases: dict) -> list[str]:
+    out = []
+    for canon in COLUMNS:
+        options = [canon] + list(aliases.get(canon, []))
+        if canon in DECORATED: options.append(DECORATED[canon])
+        out.append(r.choice(options))
+    # Los encabezados de una tabla de Excel deben ser únicos
+    seen = {}
+    for i, h in enumerate(out):
+        if h in seen: out[i] = list(COLUMNS)[i]
+        seen[out[i]] = True
+    return out
+
+_RE_INLINE = re.compile(rb'<c r="([A-Z]+[0-9]+)"([^>]*?) t="inlineStr"><is><t(?: xml:space="preserve")?>(.*?)</t></is></c>', re.S)
+_SST_CT = (b'<Override PartName="/xl/sharedStrings.xml" '
+           b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml" />')
+_SST_REL = (b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+            b'Target="sharedStrings.xml" Id="rIdSST" />')
+
+def _to_shared_strings(data: bytes, dimension: str) -> bytes:
+    """openpyxl guarda los textos en línea (`inlineStr`) y sin `<dimension>`; Excel usa
+    `sharedStrings.xml` y declara el rango usado. Ambas cosas cambian mucho el tiempo de
+    lectura (sin `<dimension>` openpyxl recorre la hoja entera solo para medirla), así
+    que se reescribe el libro como lo guardaría Excel."""
+    index, strings = {}, []
+    def repl(m):
+        k = index.setdefault(m.group(3), len(strings))
+        if k == len(strings): strings.append(m.group(3))
+        return b'<c r="%s"%s t="s"><v>%d</v></c>' % (m.group(1), m.group(2), k)
+    src, bio = zipfile.ZipFile(io.BytesIO(data)), io.BytesIO()
+    with zipfile.ZipFile(bio, "w", zipfile.ZIP_DEFLATED) as out:
+        for item in src.infolist():
+            raw = src.read(item)
+            if item.filename.startswith("xl/worksheets/sheet"):
+                raw = _RE_INLINE.sub(repl, raw)
+                raw = raw.replace(b"<sheetViews>", b'<dimension ref="%s" /><sheetViews>' % dimension.encode(), 1)
+            elif item.filename == "[Content_Types].xml": raw = raw.replace(b"</Types>", _SST_CT + b"</Types>")
+            elif item.filename == "xl/_rels/workbook.xml.rels": raw = raw.replace(b"</Relationships>", _SST_REL + b"</Relationships>")
+            out.writestr(item, raw)
+        sst = b"".join(b'<si><t xml:space="preserve">%s</t></si>' % t for t in strings)
+        out.writestr("xl/sharedStrings.xml",
+                     b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="%d" uniqueCount="%d">%s</sst>'
+                     % (len(strings), len(strings), sst))
+    return bio.getvalue()
+
+def generate_workbook(rows: int, seed: int = 0, missing_ratio: float = 0.02, junk_rows: int = 4,
+                      aliases: dict | None = None) -> bytes:
+    """Devuelve los bytes de un .xlsx con `rows` filas en la tabla `SIOT`.
+
+    `missing_ratio` es la fracción de filas con algún obligatorio vacío."""
+    if aliases is None:
+        from siot_pipeline import ALIASES as aliases
+    r = random.Random(seed)
+    headers = _headers(r, aliases)
+    gens = list(COLUMNS.values())
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("SIOT")
+    for k in range(junk_rows):
+        ws.append(["INSTRUCCIÓN OPERACIONAL DE TRABAJOS" if k == 0 else None, None, f"Semana {k}"])
+    ws.append(headers)
+    for _ in range(rows):
+        row = [g(r) for g in gens]
+        if r.random() < missing_ratio:
+            row[r.choice(_MISSING_COLS)] = None
+        ws.append(row)
+    first = junk_rows + 1
+    ref = f"A{first}:{get_column_letter(len(headers))}{first + rows}"
+    table = Table(displayName="SIOT", ref=ref)
+    # En modo write-only las columnas de la tabla se declaran a mano
+    table.tableColumns = [TableColumn(id=i + 1, name=h) for i, h in enumerate(headers)]
+    table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium2", showRowStripes=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # openpyxl avisa aunque las columnas ya estén declaradas
+        ws.add_table(table)
+    bio = io.BytesIO()
+    wb.save(bio)
+    return _to_shared_strings(bio.getvalue(), f"A1:{get_column_letter(len(headers))}{first + rows}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Genera un Excel SIOT sintético.")
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--missing-ratio", type=float, default=0.02)
+    ap.add_argument("--out", required=True)
+    args = ap.parse_args(argv)
+    data = generate_workbook(args.rows, seed=args.seed, missing_ratio=args.missing_ratio)
+    with open(args.out, "wb") as f: f.write(data)
+    print(f"{args.out}: {args.rows} filas, {len(data) / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
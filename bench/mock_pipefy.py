@@ -0,0 +1,203 @@
+# bench/mock_pipefy.py
+"""Servidor GraphQL falso de Pipefy para benchmarks y pruebas de carga.
+
+Responde las consultas que usa el pipeline: etiquetas y formulario de inicio del pipe,
+`createCard` (simple y en lote con alias `c0`, `c1`, ...) y `allCards`. Latencia, errores GraphQL, 5xx y 429
+(con `Retry-After`) son configurables para reproducir límites de tasa y fallas.
+
+    python -m bench.mock_pipefy --port 8765 --latency 0.05 --throttle-rate 20
+    PIPEFY_API_URL=http://127.0.0.1:8765/graphql streamlit run app.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LABELS = ["URGENTE", "PROGRAMADO", "NOCTURNO"]
+# Formulario de inicio: lo justo para la pre-validación (los demás campos se aceptan)
+FORM_FIELDS = [
+    {"id": "empresa", "label": "Empresa", "type": "short_text", "required": True, "options": []},
+    {"id": "tipo_de_mantenimiento", "label": "Tipo de mantenimiento", "type": "select", "required": False,
+     "options": ["PREVENTIVO", "CORRECTIVO", "INSPECCIÓN"]},
+    {"id": "veh_culo", "label": "Vehículo", "type": "checklist_vertical", "required": False,
+     "options": ["Camioneta", "Camión", "Dresina", "Ninguno"]},
+    {"id": "r1_1", "label": "R1", "type": "checklist_horizontal", "required": False, "options": ["SI", "NO"]},
+    {"id": "p1", "label": "P1", "type": "checklist_horizontal", "required": False, "options": ["SI", "NO"]},
+    {"id": "correo_electr_nico_del_solicitante", "label": "Correo del solicitante", "type": "email",
+     "required": False, "options": []},
+    {"id": "fecha_de_inicio", "label": "Fecha de inicio", "type": "date", "required": True, "options": []},
+]
+_RE_ALIAS = re.compile(r"\b(c\d+)\s*:\s*createCard")
+
+class MockPipefy:
+    """Estado del servidor falso. Los parámetros se pueden cambiar en caliente.
+
+    - `latency`: segundos por solicitud (± `jitter`).
+    - `error_rate`: fracción de tarjetas rechazadas con error GraphQL.
+    - `http_error_rate`: fracción de solicitudes que devuelven 502.
+    - `throttle_rate`: solicitudes/s admitidas; por encima responde 429 con `Retry-After`.
+    - `malformed_rate`: fracción de `createCard` respondidos 200 con un JSON que no es objeto.
+    - `keep_fields`: guardar los campos de cada tarjeta (para `allCards`); desactivarlo
+      evita que la memoria del servidor se mezcle con la del cliente en los benchmarks."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 http_error_rate: float = 0.0, throttle_rate: float | None = None,
+                 retry_after: float = 1.0, labels: list | None = None, seed: int | None = None,
+                 keep_fields: bool = True, form_fields: list | None = None, malformed_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self.labels = list(LABELS if labels is None else labels)
+        self.form_fields = list(FORM_FIELDS if form_fields is None else form_fields)
+        self.keep_fields = keep_fields
+        self.stats = Counter()
+        self.cards = {}             # id -> {"title", "fields"}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = (0, 0)      # (segundo, solicitudes en ese segundo)
+        self._server = None
+
+    # ---- Respuestas ----
+    def _count(self, name: str):
+        with self._lock: self.stats[name] += 1
+
+    def _throttled(self) -> bool:
+        if not self.throttle_rate: return False
+        now = int(time.monotonic())
+        with self._lock:
+            sec, n = self._window
+            n = n + 1 if sec == now else 1
+            self._window = (now, n)
+            return n > self.throttle_rate
+
+    def _roll(self, p: float) -> bool:
+        if p <= 0: return False
+        with self._lock: return self._rng.random() < p
+
+    def _create(self, inp: dict) -> dict | None:
+        if self._roll(self.error_rate): return None
+        with self._lock:
+            card_id = str(100000 + len(self.cards))
+            fields = (inp.get("fields_attributes") or []) if self.keep_fields else []
+            self.cards[card_id] = {"title": inp.get("title"), "fields": fields}
+            self.stats["cards_created"] += 1
+        return {"card": {"id": card_id, "title": inp.get("title")}}
+
+    def _all_cards(self, variables: dict) -> dict:
+        first = int(variables.get("first") or 50)
+        start = int(variables.get("after") or 0)
+        with self._lock: items = list(self.cards.items())[start:start + first]
+        edges = [{"node": {"id": cid, "fields": [
+            {"field": {"id": f.get("field_id")}, "value": f.get("field_value")} for f in card["fields"]
+        ]}} for cid, card in items]
+        end = start + len(items)
+        with self._lock: more = end < len(self.cards)
+        return {"allCards": {"pageInfo": {"hasNextPage": more, "endCursor": str(end)}, "edges": edges}}
+
+    def handle(self, body: dict) -> tuple[int, dict, dict]:
+        """`(status, headers, json)` para un cuerpo GraphQL."""
+        self._count("requests")
+        if self._throttled():
+            self._count("http_429")
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, {"error": "Too Many Requests"}
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self._roll(self.http_error_rate):
+            self._count("http_502")
+            return 502, {}, {"error": "Bad Gateway"}
+
+        query, variables = body.get("query", ""), body.get("variables") or {}
+        if "start_form_fields" in query:
+            self._count("start_form")
+            return 200, {}, {"data": {"pipe": {"start_form_fields": self.form_fields}}}
+        if "labels" in query:
+            self._count("labels")
+            labels = [{"id": f"L{i}", "name": n} for i, n in enumerate(self.labels, 1)]
+            return 200, {}, {"data": {"pipe": {"labels": labels}}}
+        if "allCards" in query:
+            self._count("all_cards")
+            return 200, {}, {"data": self._all_cards(variables)}
+        if "createCard" in query:
+            if self._roll(self.malformed_rate):
+                self._count("malformed")
+                return 200, {}, ["Simulated malformed body"]
+            aliases = _RE_ALIAS.findall(query)
+            if not aliases:  # mutación simple: createCard(input: $input)
+                card = self._create(variables.get("input") or {})
+                if card is None: return 200, {}, {"errors": [{"message": "Simulated error", "path": ["createCard"]}]}
+                return 200, {}, {"data": {"createCard": card}}
+            data, errors = {}, []
+            for alias in aliases:
+                card = self._create(variables.get("i" + alias[1:]) or {})
+                data[alias] = card
+                if card is None: errors.append({"message": "Simulated error", "path": [alias]})
+            self._count("batches")
+            return 200, {}, {"data": data, **({"errors": errors} if errors else {})}
+        return 200, {}, {"errors": [{"message": "Unsupported query"}]}
+
+    # ---- Servidor ----
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Arranca en un hilo y devuelve la URL GraphQL."""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+            def log_message(self, *args): pass
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                try: body = json.loads(self.rfile.read(n) or b"{}")
+                except ValueError: body = {}
+                status, headers, out = mock.handle(body)
+                raw = json.dumps(out).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in headers.items(): self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-pipefy").start()
+        return f"http://{host}:{self._server.server_port}/graphql"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servidor GraphQL falso de Pipefy.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.05, help="Segundos por solicitud")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fracción de tarjetas con error GraphQL")
+    ap.add_argument("--http-error-rate", type=float, default=0.0, help="Fracción de solicitudes con 502")
+    ap.add_argument("--throttle-rate", type=float, default=None, help="Solicitudes/s antes de responder 429")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0, help="Fracción de createCard con cuerpo JSON inválido")
+    args = ap.parse_args(argv)
+    mock = MockPipefy(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      http_error_rate=args.http_error_rate, throttle_rate=args.throttle_rate,
+                      retry_after=args.retry_after, malformed_rate=args.malformed_rate)
+    print(f"Mock Pipefy en {mock.start(args.host, args.port)} (Ctrl+C para salir)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+        print(dict(mock.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# bench/run_bench.py
+"""Benchmarks de punta a punta del pipeline SIOT contra un Pipefy falso.
+
+Por cada tamaño genera un libro sintético y mide lectura, alias, recorte, fechas,
+validación, armado de payloads y la subida completa (`run_upload_job` con bitácora
+temporal). Reporta filas/s por fase y, con `--memory`, el pico de memoria (tracemalloc;
+agrega sobrecosto, así que los tiempos de esa corrida no son comparables).
+
+    python -m bench.run_bench --rows 100 1000 10000
+    python -m bench.run_bench --rows 5000 --rate 50 --batch-size 10 --latency 0.05 --throttle-rate 30 --json bench.json
+    python -m bench.run_bench --rows 100000 --skip-upload --memory
+    python -m bench.run_bench --rows 20000 --rate 500 --batch-size 10 --stream
+
+Cada subida verifica que todas las filas tengan exactamente un resultado (creada o con
+error), también ante lotes que fallan enteros. Con `--stream` además verifica que el modo streaming (en bloques chicos) genere las mismas
+claves de bitácora y los mismos payloads que el modo completo; si no, termina con código 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from bench.mock_pipefy import MockPipefy
+from bench.generate_workbook import generate_workbook
+
+def _measure(fn, memory: bool):
+    """`(resultado, segundos, pico_bytes|None)` de `fn()`."""
+    if memory:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        out = fn()
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory: tracemalloc.stop()
+    return out, elapsed, peak
+
+def _max_rss_mb() -> float | None:
+    try: import resource
+    except ImportError: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+PARITY_CHUNK_ROWS = 257  # bloque chico (y no redondo) para cruzar muchos bordes de bloque
+
+def check_stream_parity(sp, content: bytes, pipe_id: int, chunk_size: int = PARITY_CHUNK_ROWS) -> dict:
+    """Claves (`row_keys`) y payloads del modo completo vs. los del streaming por bloques.
+    Un archivo subido en un modo y retomado en el otro solo se reanuda si coinciden."""
+    df, _, valid_mask, _ = sp.prepare_dataframe(content, "SIOT")
+    full = df[valid_mask]
+    keys, payloads = sp.row_keys(full, pipe_id), sp.build_payloads(full, {}, [])
+    seen, s_keys, s_payloads = {}, [], []
+    for chunk in sp.trim_stream(sp.iter_source_chunks(content, "SIOT", chunk_size)):
+        if chunk.empty: continue
+        chunk, _, mask, _ = sp.normalize_and_validate(chunk)
+        s_keys += sp.row_keys(chunk[mask], pipe_id, seen=seen)
+        s_payloads += sp.build_payloads(chunk[mask], {}, [])
+    return {"rows": len(keys), "stream_rows": len(s_keys),
+            "keys_diff": sum(a != b for a, b in zip(keys, s_keys)) + abs(len(keys) - len(s_keys)),
+            "payloads_diff": sum(a != b for a, b in zip(payloads, s_payloads))}
+
+def check_batch_alignment(sp, rows: int = 25, batch_size: int = 10) -> bool:
+    """`upload_cards` entrega un `(ok, info)` por fila aunque el envío del lote lance una excepción."""
+    original = sp.pipefy_create_cards_batch
+    def _raises(token, pipe_id, items): raise ValueError("lote simulado con error")
+    sp.pipefy_create_cards_batch = _raises
+    try: results = list(sp.upload_cards((([], f"t{k}") for k in range(rows)), "bench-token", 1, batch_size=batch_size))
+    finally: sp.pipefy_create_cards_batch = original
+    return len(results) == rows and all(r[0] is False and isinstance(r[1], sp.CardError) for r in results)
+
+def bench_size(sp, rows: int, args, mock: MockPipefy) -> dict:
+    """Corre todas las fases para un libro de `rows` filas."""
+    content, gen_s, _ = _measure(lambda: generate_workbook(rows, seed=args.seed, missing_ratio=args.missing_ratio), False)
+    result = {"rows": rows, "xlsx_mb": round(len(content) / 1e6, 2), "generate_s": round(gen_s, 3), "phases": {}}
+
+    def phase(name, fn, n=rows):
+        out, secs, peak = _measure(fn, args.memory)
+        result["phases"][name] = {
+            "seconds": round(secs, 4),
+            "rows_per_sec": round(n / secs, 1) if secs > 0 else None,
+            **({"peak_mb": round(peak / 1e6, 2)} if peak is not None else {}),
+        }
+        return out
+
+    df = phase("read_excel_table_siot", lambda: sp.read_excel_table_siot(content, "SIOT"))
+    df = phase("apply_aliases", lambda: sp.apply_aliases(df))
+    df = phase("trim_to_last_empresa", lambda: sp.trim_to_last_empresa(df))
+    df, _ = phase("normalize_temporal_columns", lambda: sp.normalize_temporal_columns(df))
+    _, valid_mask = phase("validate_required", lambda: sp.validate_required(df))
+    df_validas = df[valid_mask]
+    result["rows_valid"] = int(valid_mask.sum())
+
+    labels_map = sp.get_labels_cache().get(args.token, args.pipe_id)
+    phase("build_payloads", lambda: list(sp.build_payloads(df_validas, labels_map, [])), len(df_validas))
+    phase("prepare_dataframe (total)", lambda: sp.prepare_dataframe(content, "SIOT"))
+
+    if not args.skip_upload:
+        upload = df_validas.head(args.upload_rows) if args.upload_rows else df_validas
+        before = dict(mock.stats)
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = sp.UploadJournal(str(Path(tmp) / "journal.sqlite3"))
+            keys = sp.row_keys(upload, args.pipe_id)
+            job = sp.UploadJob("bench", args.pipe_id, f"bench_{rows}.xlsx", len(upload))
+            phase("upload (run_upload_job)", lambda: sp.run_upload_job(
+                job, args.token, upload, keys, sp.build_titles(upload), sp.row_numbers(upload.index).tolist(), journal,
+            ), len(upload))
+        result["upload"] = {
+            "status": job.status, "created": job.creadas, "failed": job.errores, "message": job.message,
+            "aligned": job.status == "finished" and job.creadas + job.errores == len(upload),
+            "first_card_s": round(job.first_card_at - job.created_at, 3) if job.first_card_at else None,
+            "server": {k: v - before.get(k, 0) for k, v in mock.stats.items() if v - before.get(k, 0)},
+        }
+    if args.stream:
+        # Lectura + subida por bloques, desde los bytes del libro (incluye el parseo)
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = sp.UploadJournal(str(Path(tmp) / "journal.sqlite3"))
+            job = sp.UploadJob("bench", args.pipe_id, f"bench_{rows}.xlsx", 0)
+            phase("parse+upload (streaming)", lambda: sp.run_streaming_upload_job(job, args.token, content, journal))
+        result["stream"] = {
+            "status": job.status, "created": job.creadas, "failed": job.errores, "message": job.message,
+            "first_card_s": round(job.first_card_at - job.created_at, 3) if job.first_card_at else None,
+        }
+        result["stream_parity"] = check_stream_parity(sp, content, args.pipe_id)
+    return result
+
+def _print_result(res: dict):
+    print(f"\n== {res['rows']} filas ({res['xlsx_mb']} MB, válidas {res['rows_valid']}) ==")
+    for name, ph in res["phases"].items():
+        rps = f"{ph['rows_per_sec']:>12,.0f} filas/s" if ph["rows_per_sec"] else " " * 19
+        mem = f"  pico {ph['peak_mb']:>8.2f} MB" if "peak_mb" in ph else ""
+        print(f"  {name:<28} {ph['seconds']:>9.3f} s {rps}{mem}")
+    if "upload" in res:
+        up = res["upload"]
+        print(f"  subida: {up['status']}{'' if up['aligned'] else ' (FILAS SIN RESULTADO)'} · "
+              f"creadas {up['created']} · errores {up['failed']} · "
+              f"primera tarjeta {up['first_card_s']} s · servidor {up['server']}")
+    if "stream" in res:
+        up = res["stream"]
+        print(f"  streaming: {up['status']} · creadas {up['created']} · errores {up['failed']} · "
+              f"primera tarjeta {up['first_card_s']} s desde el inicio del parseo")
+    if "stream_parity" in res:
+        par = res["stream_parity"]
+        ok = not par["keys_diff"] and not par["payloads_diff"]
+        print(f"  paridad streaming/completo: {'OK' if ok else 'DIFIERE'} · claves distintas {par['keys_diff']} · "
+              f"payloads distintos {par['payloads_diff']} (de {par['rows']})")
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="Benchmarks del pipeline SIOT con un Pipefy falso.")
+    ap.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000], help="Tamaños de libro a medir")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--missing-ratio", type=float, default=0.02, help="Fracción de filas con obligatorios vacíos")
+    ap.add_argument("--memory", action="store_true", help="Medir pico de memoria por fase (tracemalloc)")
+    ap.add_argument("--skip-upload", action="store_true", help="No medir la subida")
+    ap.add_argument("--upload-rows", type=int, default=0, help="Limitar filas subidas por tamaño (0 = todas)")
+    ap.add_argument("--stream", action="store_true", help="Medir también lectura+subida en modo streaming")
+    ap.add_argument("--rate", type=float, help="PIPEFY_RATE_PER_SEC del cliente (default: el configurado)")
+    ap.add_argument("--batch-size", type=int, help="PIPEFY_BATCH_SIZE (tarjetas por solicitud)")
+    ap.add_argument("--in-flight", type=int, help="PIPEFY_MAX_IN_FLIGHT (solicitudes simultáneas)")
+    ap.add_argument("--latency", type=float, default=0.0, help="Latencia del servidor falso (s)")
+    ap.add_argument("--jitter", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--http-error-rate", type=float, default=0.0)
+    ap.add_argument("--throttle-rate", type=float, default=None)
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0, help="Fracción de createCard con cuerpo JSON inválido")
+    ap.add_argument("--json", help="Guardar resultados en este archivo JSON")
+    return ap
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    mock = MockPipefy(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      http_error_rate=args.http_error_rate, throttle_rate=args.throttle_rate,
+                      retry_after=args.retry_after, seed=args.seed, keep_fields=False,
+                      malformed_rate=args.malformed_rate)
+    # El pipeline toma URL y ajustes al importarse: se apunta al mock antes del import
+    os.environ["PIPEFY_API_URL"] = mock.start()
+    for env, val in (("PIPEFY_RATE_PER_SEC", args.rate), ("PIPEFY_BATCH_SIZE", args.batch_size),
+                     ("PIPEFY_MAX_IN_FLIGHT", args.in_flight)):
+        if val is not None: os.environ[env] = str(val)
+    args.token, args.pipe_id = "bench-token", 1
+    import siot_pipeline as sp
+
+    results = []
+    try:
+        for rows in args.rows:
+            res = bench_size(sp, rows, args, mock)
+            _print_result(res)
+            results.append(res)
+    finally:
+        mock.stop()
+
+    report = {
+        "python": platform.python_version(), "platform": platform.platform(),
+        "settings": {k: getattr(sp, k) for k in ("PIPEFY_MAX_IN_FLIGHT", "PIPEFY_RATE_PER_SEC",
+                                                  "PIPEFY_BATCH_SIZE", "PIPEFY_MAX_RETRIES")},
+        "mock": {k: getattr(args, k) for k in ("latency", "jitter", "error_rate", "http_error_rate",
+                                              "throttle_rate", "retry_after", "malformed_rate")},
+        "max_rss_mb": _max_rss_mb(), "results": results,
+    }
+    print(f"\nRSS máximo del proceso: {report['max_rss_mb']:.1f} MB" if report["max_rss_mb"] else "")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Resultados en {args.json}")
+    aligned = check_batch_alignment(sp) and all(r["upload"]["aligned"] for r in results if "upload" in r)
+    print("Alineación filas/resultados: " + ("OK" if aligned else "FALLA"))
+    parity = [r["stream_parity"] for r in results if "stream_parity" in r]
+    return 1 if not aligned or any(p["keys_diff"] or p["payloads_diff"] for p in parity) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# siot_cli.py
+"""Carga masiva SIOT sin navegador.
+
+Lee todos los .xlsx indicados (carpetas o patrones glob), los parsea en paralelo con
+un pool de procesos y los sube a Pipefy por una única etapa de envío compartida (misma
+tasa y concurrencia que la app). Por cada archivo escribe un JSON con el resultado,
+nombrado por su ruta relativa a la carpeta común (`contratistaA__semana.json`).
+
+    python siot_cli.py "entrantes/*.xlsx" --out resultados/
+    python siot_cli.py entrantes/ --workers 4 --dry-run
+    python siot_cli.py entrantes/ --metrics metricas/siot.prom
+    python siot_cli.py gigante.xlsx --stream
+
+Credenciales y ajustes se leen de variables de entorno (PIPEFY_TOKEN, PIPEFY_PIPE_ID,
+JOURNAL_PATH, PIPEFY_BATCH_SIZE, ...), igual que los secrets de la app.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from siot_pipeline import (
+    PIPEFY_TOKEN, PIPE_ID, JOURNAL_PATH,
+    UploadJob, build_titles, find_existing_cards, get_form_schema, get_metrics, get_upload_journal,
+    prepare_dataframe, run_streaming_upload_job, run_upload_job, select_rows,
+)
+
+def expand_inputs(specs: list[str]) -> list[Path]:
+    """Carpetas -> sus *.xlsx; patrones glob -> coincidencias. Omite archivos temporales de Excel (~$)."""
+    found = []
+    for spec in specs:
+        p = Path(spec)
+        matches = sorted(p.glob("*.xlsx")) if p.is_dir() else sorted(Path(m) for m in glob.glob(spec, recursive=True))
+        found.extend(m for m in matches if m.is_file() and not m.name.startswith("~$"))
+    return list(dict.fromkeys(found))
+
+def report_names(files: list[Path]) -> dict[Path, str]:
+    """Nombre del reporte JSON de cada archivo: su ruta relativa a la carpeta común, con
+    `__` en lugar de `/` (`contratistaA/semana.xlsx` -> `contratistaA__semana.json`), para
+    que archivos homónimos de distintas carpetas no se pisen. Falla si dos coinciden igual."""
+    paths = [f.resolve() for f in files]
+    base = Path(os.path.commonpath([p.parent for p in paths])) if paths else Path()
+    names, seen = {}, {}
+    for f, p in zip(files, paths):
+        name = "__".join(p.relative_to(base).with_suffix(".json").parts)
+        if name.casefold() in seen:  # casefold: en Windows/macOS el disco no distingue mayúsculas
+            raise ValueError(f"{f} y {seen[name.casefold()]} generarían el mismo reporte {name}.")
+        seen[name.casefold()] = f
+        names[f] = name
+    return names
+
+def _parse_file(path: str, table_name: str):
+    """Se ejecuta en un proceso del pool: devuelve el resultado de `prepare_dataframe`
+    y las métricas de ese parseo (el proceso padre las suma a las suyas)."""
+    get_metrics().reset()
+    t0 = time.perf_counter()
+    result = prepare_dataframe(Path(path).read_bytes(), table_name)
+    return result, time.perf_counter() - t0, get_metrics().snapshot()
+
+def upload_parsed(path: Path, parsed, token: str, pipe_id: int, journal, skip_existing: bool = False,
+                  retry_failed_only: bool = False, dry_run: bool = False, prevalidate_rows: bool = True) -> dict:
+    """Sube un archivo ya parseado y arma su reporte. Con `prevalidate_rows` no se envían
+    las filas que el formulario de inicio del pipe rechazaría (`rejected_rows`)."""
+    df, faltantes, valid_mask, fechas_invalidas = parsed
+    df_validas = df[valid_mask] if len(df) else df
+    report = {
+        "file": str(path), "pipe_id": pipe_id, "status": "ok",
+        "rows_total": len(df), "rows_valid": len(df_validas), "rows_invalid": len(df) - len(df_validas),
+        "invalid_rows": faltantes.to_dict("records"), "unparsed_datetimes": fechas_invalidas.to_dict("records"),
+        "skipped_already_uploaded": 0, "rejected_rows": [], "skipped_existing_cards": [], "to_upload": 0,
+        "created": 0, "failed": 0, "cards": [], "errors": [], "missing_labels": [],
+    }
+    if df.empty:
+        report.update(status="error", error="No se logró leer datos de la tabla SIOT ni por fallback de encabezados.")
+        return report
+
+    schema = get_form_schema(token, pipe_id) if prevalidate_rows and token else None
+    existentes = find_existing_cards(df_validas, token, pipe_id) if skip_existing else None
+    sel = select_rows(df_validas, pipe_id, journal, schema=schema, existentes=existentes)
+    report["skipped_already_uploaded"] = sel.estados.count("done")
+    if sel.rechazos is not None: report["rejected_rows"] = sel.rechazos.to_dict("records")
+    report["skipped_existing_cards"] = [{"fila": sel.filas[p], "card_id": cid} for p, cid in sel.duplicados]
+    pos = sel.positions(retry_failed_only)
+    report["to_upload"] = len(pos)
+    if dry_run or not pos: return report
+
+    titles = build_titles(df_validas)
+    job = UploadJob("cli", pipe_id, path.name, len(pos))
+    run_upload_job(job, token, df_validas.iloc[pos], [sel.keys[p] for p in pos], [titles[p] for p in pos],
+                   [sel.filas[p] for p in pos], journal)
+    report.update(
+        created=job.creadas, failed=job.errores, missing_labels=sorted(job.missing_labels),
+        cards=[{"fila": f, "card_id": c} for f, c in job.cards],
+        errors=sorted(job.errors, key=lambda e: e["fila"]),
+    )
+    if job.status == "failed": report.update(status="error", error=job.message)
+    return report
+
+def upload_streaming(path: Path, token: str, pipe_id: int, journal, table_name: str = "SIOT",
+                     skip_existing: bool = False, retry_failed_only: bool = False,
+                     prevalidate_rows: bool = True) -> dict:
+    """Lee y sube un archivo por bloques (`run_streaming_upload_job`) y arma su reporte."""
+    job = UploadJob("cli", pipe_id, path.name, 0)
+    run_streaming_upload_job(job, token, path.read_bytes(), journal, table_name,
+                             retry_failed_only=retry_failed_only, skip_existing=skip_existing,
+                             prevalidate_rows=prevalidate_rows)
+    report = {
+        "file": str(path), "pipe_id": pipe_id, "status": "ok", "streaming": True,
+        "rows_total": job.rows_read, "rows_valid": job.rows_read - len(job.invalid_rows),
+        "rows_invalid": len(job.invalid_rows), "invalid_rows": job.invalid_rows, "unparsed_datetimes": job.unparsed,
+        "skipped_already_uploaded": job.skipped_done, "rejected_rows": job.rejected,
+        "skipped_existing_cards": [{"fila": f, "card_id": c} for f, c in job.skipped_existing],
+        "to_upload": job.queued, "created": job.creadas, "failed": job.errores,
+        "cards": [{"fila": f, "card_id": c} for f, c in job.cards],
+        "errors": sorted(job.errors, key=lambda e: e["fila"]), "missing_labels": sorted(job.missing_labels),
+        "first_card_seconds": round(job.first_card_at - job.created_at, 3) if job.first_card_at else None,
+    }
+    if job.status == "failed": report.update(status="error", error=job.message)
+    if not job.rows_read and job.status != "failed":
+        report.update(status="error", error="No se logró leer datos de la tabla SIOT ni por fallback de encabezados.")
+    return report
+
+def _write_report(out_dir: Path, name: str, report: dict):
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+    target = out_dir / name
+    tmp = target.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(report, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    os.replace(tmp, target)
+    return target
+
+def write_metrics(path: str):
+    """Métricas del proceso: formato Prometheus si termina en .prom/.txt, si no JSON."""
+    m = get_metrics()
+    body = (m.to_prometheus() if path.endswith((".prom", ".txt"))
+            else json.dumps(m.snapshot(), ensure_ascii=False, indent=2))
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.write_text(body, encoding="utf-8")
+    os.replace(tmp, target)  # atómico: apto para el textfile collector de node_exporter
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="Carga masiva de Excel SIOT a Pipefy (sin navegador).")
+    ap.add_argument("inputs", nargs="+", help="Carpetas o patrones glob de archivos .xlsx")
+    ap.add_argument("--out", default="resultados", help="Carpeta de reportes JSON (default: resultados)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Procesos para parsear en paralelo")
+    ap.add_argument("--table", default="SIOT", help="Nombre de la tabla de Excel (default: SIOT)")
+    ap.add_argument("--pipe-id", type=int, default=PIPE_ID, help="Pipe destino (default: PIPEFY_PIPE_ID)")
+    ap.add_argument("--journal", default=JOURNAL_PATH, help="Bitácora SQLite de envíos (default: JOURNAL_PATH)")
+    ap.add_argument("--skip-existing", action="store_true", help="Omitir filas que ya existen como tarjetas en el pipe")
+    ap.add_argument("--retry-failed", action="store_true", help="Enviar solo las filas que fallaron antes")
+    ap.add_argument("--dry-run", action="store_true", help="Parsear y reportar sin crear tarjetas")
+    ap.add_argument("--no-prevalidate", action="store_true",
+                    help="No revisar las filas contra el formulario de inicio del pipe antes de enviar")
+    ap.add_argument("--stream", action="store_true",
+                    help="Leer y subir cada archivo por bloques (uno a la vez; la subida empieza sin esperar el parseo)")
+    ap.add_argument("--metrics", help="Guardar métricas de tiempos/latencias (.prom = Prometheus, otro = JSON)")
+    return ap
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.stream and args.dry_run:
+        print("--stream sube mientras lee; para solo parsear usa --dry-run sin --stream.", file=sys.stderr)
+        return 2
+    if not args.dry_run and (not PIPEFY_TOKEN or not args.pipe_id):
+        print("Faltan credenciales: define PIPEFY_TOKEN y PIPEFY_PIPE_ID (o --pipe-id).", file=sys.stderr)
+        return 2
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No se encontraron archivos .xlsx.", file=sys.stderr)
+        return 2
+    try: names = report_names(files)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    journal = get_upload_journal(args.journal)
+
+    ok = True
+    def _done(path: Path, report: dict):
+        nonlocal ok
+        ok &= report["status"] == "ok" and not report.get("failed")
+        target = _write_report(out_dir, names[path], report)
+        print(f"{path}: {report['status']} · creadas {report.get('created', 0)} · "
+              f"errores {report.get('failed', 0)} · pendientes {report.get('to_upload', 0)} -> {target}")
+
+    if args.stream:
+        # Un archivo a la vez: dentro de cada uno, lectura y subida se solapan por bloques
+        for path in files:
+            t0 = time.perf_counter()
+            try:
+                report = upload_streaming(path, PIPEFY_TOKEN, args.pipe_id, journal, args.table,
+                                          skip_existing=args.skip_existing, retry_failed_only=args.retry_failed,
+                                          prevalidate_rows=not args.no_prevalidate)
+                report["upload_seconds"] = round(time.perf_counter() - t0, 3)
+            except Exception as e:
+                report = {"file": str(path), "pipe_id": args.pipe_id, "status": "error", "error": str(e)}
+            _done(path, report)
+        if args.metrics: write_metrics(args.metrics)
+        return 0 if ok else 1
+
+    # Parseo en paralelo; cada archivo pasa a la etapa de envío apenas está listo
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as pool:
+        futures = {pool.submit(_parse_file, str(f), args.table): f for f in files}
+        for fut in as_completed(futures):
+            path = futures[fut]
+            try:
+                parsed, parse_s, parse_metrics = fut.result()
+                get_metrics().merge(parse_metrics)
+                t0 = time.perf_counter()
+                report = upload_parsed(path, parsed, PIPEFY_TOKEN, args.pipe_id, journal,
+                                       skip_existing=args.skip_existing, retry_failed_only=args.retry_failed,
+                                       dry_run=args.dry_run, prevalidate_rows=not args.no_prevalidate)
+                report.update(parse_seconds=round(parse_s, 3), upload_seconds=round(time.perf_counter() - t0, 3))
+            except Exception as e:
+                report = {"file": str(path), "pipe_id": args.pipe_id, "status": "error", "error": str(e)}
+            _done(path, report)
+    if args.metrics: write_metrics(args.metrics)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2037 @@
+# siot_pipeline.py
+"""Pipeline SIOT sin interfaz: lectura del Excel -> alias -> recorte -> validación ->
+mapeo a campos de Pipefy -> envío. Lo usan la app de Streamlit (`app.py`) y la CLI
+(`siot_cli.py`); no importa Streamlit."""
+import os
+import io
+import re
+import sys
+import json
+import time
+import uuid
+import bisect
+import random
+import pickle
+import sqlite3
+import queue
+import hashlib
+import functools
+import contextlib
+import threading
+import unicodedata
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import NamedTuple
+from datetime import date, datetime, time as dtime, timezone
+from email.utils import parsedate_to_datetime
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from openpyxl import load_workbook
+from openpyxl.utils.cell import range_boundaries
+
+# =============== Secrets / Pipefy ===============
+def get_secret(name, default=None):
+    """`st.secrets` si corre dentro de Streamlit; si no, variables de entorno."""
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try: return st.secrets[name]
+        except Exception: pass
+    return os.getenv(name, default)
+
+def _secret_list(name: str, default: list) -> list:
+    """Secret con lista (JSON en texto o arreglo TOML)."""
+    raw = get_secret(name, None)
+    if not raw: return default
+    return json.loads(raw) if isinstance(raw, str) else list(raw)
+
+# URL configurable para poder apuntar a un servidor GraphQL local de pruebas
+PIPEFY_API_URL = get_secret("PIPEFY_API_URL", "https://api.pipefy.com/graphql")
+PIPEFY_TOKEN = get_secret("PIPEFY_TOKEN", "")
+PIPE_ID      = int(str(get_secret("PIPEFY_PIPE_ID", "0")) or "0")
+
+# Concurrencia del envío: solicitudes simultáneas y tasa máxima (req/seg)
+PIPEFY_MAX_IN_FLIGHT = int(str(get_secret("PIPEFY_MAX_IN_FLIGHT", "8")) or "8")
+PIPEFY_RATE_PER_SEC  = float(str(get_secret("PIPEFY_RATE_PER_SEC", "10")) or "10")
+# Tarjetas por solicitud HTTP (mutaciones createCard con alias); 1 = sin lotes
+PIPEFY_BATCH_SIZE    = int(str(get_secret("PIPEFY_BATCH_SIZE", "1")) or "1")
+# Reintentos ante 429/5xx/errores de conexión
+PIPEFY_MAX_RETRIES   = int(str(get_secret("PIPEFY_MAX_RETRIES", "5")) or "5")
+# Espera máxima que se acepta de un `Retry-After`; si Pipefy pide más, la fila falla con el 429
+PIPEFY_MAX_RETRY_AFTER_SEC = float(str(get_secret("PIPEFY_MAX_RETRY_AFTER_SEC", "60")) or "60")
+
+# =============== Métricas (fases, latencia HTTP, throughput) ===============
+# Límites (segundos) de los histogramas, como los `le` de Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "siot_phase_seconds":         ("histogram", "Duración de cada fase del pipeline."),
+    "siot_phase_rows_total":      ("counter",   "Filas procesadas por fase."),
+    "siot_pipefy_call_seconds":   ("histogram", "Duración de cada llamada a Pipefy, con reintentos."),
+    "siot_http_request_seconds":  ("histogram", "Duración de cada intento HTTP a Pipefy."),
+    "siot_http_responses_total":  ("counter",   "Respuestas HTTP de Pipefy por operación y estado."),
+    "siot_http_retries_total":    ("counter",   "Reintentos HTTP por operación."),
+    "siot_cards_total":           ("counter",   "Tarjetas enviadas por resultado."),
+    "siot_parse_cache_total":     ("counter",   "Consultas a la caché de archivos procesados."),
+    "siot_first_card_seconds":    ("histogram", "Tiempo desde el inicio del trabajo hasta la primera tarjeta."),
+}
+
+class Histogram:
+    """Histograma de buckets fijos (conteos no acumulados; el último es +Inf)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimación por interpolación lineal dentro del bucket (como `histogram_quantile`)."""
+        if not self.count: return None
+        rank, acc = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if acc + n >= rank and n:
+                if i == len(self.buckets): return self.buckets[-1]
+                lo = self.buckets[i - 1] if i else 0.0
+                return lo + (self.buckets[i] - lo) * (rank - acc) / n
+            acc += n
+        return self.buckets[-1]
+
+class Metrics:
+    """Registro de métricas en memoria, seguro entre hilos y compartido por todo el proceso.
+
+    Contadores e histogramas se identifican por nombre + etiquetas. Se exporta como
+    JSON (`snapshot`) o en formato de texto de Prometheus (`to_prometheus`)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}   # (nombre, etiquetas) -> valor
+            self._hists = {}      # (nombre, etiquetas) -> Histogram
+            self.started_at = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock: self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None: hist = self._hists[key] = Histogram()
+            hist.observe(value)
+
+    def observe_phase(self, phase: str, seconds: float, rows: int | None = None):
+        self.observe("siot_phase_seconds", seconds, phase=phase)
+        if rows: self.inc("siot_phase_rows_total", rows, phase=phase)
+
+    @contextlib.contextmanager
+    def timer(self, phase: str, rows: int | None = None):
+        """Mide un bloque como fase; las filas se pueden fijar al final con `t.rows = n`."""
+        t = SimpleNamespace(rows=rows)
+        t0 = time.perf_counter()
+        try: yield t
+        finally: self.observe_phase(phase, time.perf_counter() - t0, t.rows)
+
+    # ---- Lectura / exportación ----
+    def snapshot(self) -> dict:
+        """Copia serializable a JSON (también sirve para `merge` entre procesos)."""
+        with self._lock:
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self._counters.items()]
+            hists = [{"name": n, "labels": dict(l), "buckets": list(h.buckets), "counts": list(h.counts),
+                      "sum": h.sum, "count": h.count} for (n, l), h in self._hists.items()]
+            started = self.started_at
+        return {"started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+                "uptime_s": round(time.time() - started, 3), "counters": counters, "histograms": hists}
+
+    def merge(self, snap: dict):
+        """Suma un `snapshot` (p.ej. de un proceso hijo) a este registro."""
+        with self._lock:
+            for c in snap.get("counters", []):
+                key = self._key(c["name"], c["labels"])
+                self._counters[key] = self._counters.get(key, 0) + c["value"]
+            for h in snap.get("histograms", []):
+                key = self._key(h["name"], h["labels"])
+                hist = self._hists.get(key)
+                if hist is None: hist = self._hists[key] = Histogram(h["buckets"])
+                if list(hist.buckets) != list(h["buckets"]): continue
+                hist.counts = [a + b for a, b in zip(hist.counts, h["counts"])]
+                hist.sum += h["sum"]
+                hist.count += h["count"]
+
+    def to_prometheus(self) -> str:
+        """Formato de exposición de texto de Prometheus (v0.0.4)."""
+        def fmt(labels: tuple, extra: tuple = ()) -> str:
+            pairs = [(k, v) for k, v in labels + extra]
+            if not pairs: return ""
+            esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted(((k, (h.buckets, list(h.counts), h.sum, h.count)) for k, h in self._hists.items()))
+        lines, seen = [], set()
+        def header(name: str, kind: str):
+            if name in seen: return
+            seen.add(name)
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, ('', name))[1]}")
+            lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{fmt(labels)} {value:g}")
+        for (name, labels), (buckets, counts, total, count) in hists:
+            header(name, "histogram")
+            acc = 0
+            for le, n in zip(list(buckets) + ["+Inf"], counts):
+                acc += n
+                lines.append(f"{name}_bucket{fmt(labels, (('le', f'{le:g}' if le != '+Inf' else le),))} {acc}")
+            lines.append(f"{name}_sum{fmt(labels)} {total:.6f}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def _summary(self, name: str, label: str) -> dict:
+        with self._lock:
+            return {dict(l).get(label, ""): h for (n, l), h in self._hists.items() if n == name}
+
+    def phase_summary(self) -> list[dict]:
+        """Por fase: llamadas, tiempo total, p50/p95 y filas/s."""
+        with self._lock:
+            rows = {dict(l).get("phase"): v for (n, l), v in self._counters.items() if n == "siot_phase_rows_total"}
+        out = []
+        for phase, h in sorted(self._summary("siot_phase_seconds", "phase").items()):
+            n = rows.get(phase, 0)
+            out.append({"fase": phase, "llamadas": h.count, "total_s": round(h.sum, 3),
+                        "p50_s": h.quantile(0.5), "p95_s": h.quantile(0.95), "filas": int(n),
+                        "filas_por_s": round(n / h.sum, 1) if n and h.sum > 0 else None})
+        return out
+
+    def http_summary(self) -> list[dict]:
+        """Por operación de Pipefy: llamadas, latencia p50/p95/p99 y respuestas por estado."""
+        with self._lock:
+            statuses, retries = {}, {}
+            for (n, l), v in self._counters.items():
+                l = dict(l)
+                if n == "siot_http_responses_total":
+                    statuses.setdefault(l.get("op"), {})[l.get("status")] = int(v)
+                elif n == "siot_http_retries_total":
+                    retries[l.get("op")] = int(v)
+        out = []
+        for op, h in sorted(self._summary("siot_pipefy_call_seconds", "op").items()):
+            out.append({"operacion": op, "llamadas": h.count, "total_s": round(h.sum, 3),
+                        "p50_s": h.quantile(0.5), "p95_s": h.quantile(0.95), "p99_s": h.quantile(0.99),
+                        "reintentos": retries.get(op, 0),
+                        "estados": ", ".join(f"{s}: {c}" for s, c in sorted(statuses.get(op, {}).items()))})
+        return out
+
+@functools.lru_cache(maxsize=None)
+def get_metrics() -> Metrics:
+    """Registro único del proceso (sobrevive a los reruns de Streamlit)."""
+    return Metrics()
+
+# =============== Normalización de columnas ===============
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+
+_RE_PARENS = re.compile(r"\(.*?\)")
+_RE_NON_KEY = re.compile(r"[^A-Z0-9/ ]")
+_RE_SPACES = re.compile(r"\s+")
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_text(s: str) -> str:
+    s = s.replace("\n", " ")                 # quita salto de línea
+    s = _RE_PARENS.sub("", s)                # quita '(...)'
+    s = s.replace("*", " ")                  # quita asteriscos
+    s = _strip_accents(s)                    # sin tildes
+    s = _RE_NON_KEY.sub(" ", s.upper())      # deja letras/números/espacio y '/'
+    s = _RE_SPACES.sub(" ", s).strip()       # colapsa espacios
+    return s
+
+def _normalize_key(s: str) -> str:
+    """Normaliza encabezados: quita paréntesis, saltos de línea, asteriscos y tildes (memoizado)."""
+    if s is None:
+        return ""
+    return _normalize_text(str(s))
+
+# -------- Mapa de alias -> nombre canónico (los que usa el envío a Pipefy) --------
+ALIASES = {
+    "EMPRESA": ["EMPRESA"],
+
+    "CCU": [
+        "CCU",
+        "CCU COORDINADOR DE CUADRILLA NOMBRE APELLIDO",
+        "COORDINADOR DE CUADRILLA",
+        "NOMBRE COORDINADOR",
+        "CCU NOMBRE APELLIDO",
+    ],
+
+    "INTEGRANTES DE CUADRILLA": [
+        "INTEGRANTES DE CUADRILLA",
+        "INTEGRANTES DEL EQUIPO DE CUADRILLA",
+        "INTEGRANTES DEL EQUIPO DE CUADRILLA NOMBRE APELLIDO - NUMERO DE CEDULA",
+    ],
+
+    "CONTACTO CCU": [
+        "CONTACTO CCU",
+        "TELEFONO DE CONTACTO CCU",
+        "TELEFONO COORDINADOR",
+    ],
+
+    # ← canónico para email
+    "CORREO DEL SOLICITANTE": [
+        "CORREO DEL SOLICITANTE",
+        "CORREO ELECTRONICO DEL SOLICITANTE",
+        "EMAIL", "E MAIL", "CORREO ELECTRONICO",
+    ],
+
+    "FECHA DE INICIO": ["FECHA DE INICIO", "FECHA INICIO", "INICIO FECHA"],
+    "FECHA DE FIN":    ["FECHA DE FIN", "FECHA FIN", "FIN FECHA"],
+    "HORA DE INICIO":  ["HORA DE INICIO", "HORA INICIO", "INICIO HORA"],
+    "HORA DE FIN":     ["HORA DE FIN", "HORA FIN", "FIN HORA"],
+
+    "CANTÓN / ESTACIÓN": ["CANTON / ESTACION", "CANTON", "ESTACION", "CANTON / ESTACION"],
+
+    # plural → canónico singular
+    "ZONA DE ESTACIÓN": ["ZONA DE ESTACION", "ZONAS DE ESTACION", "ZONAS DE ESTACION "],
+
+    "CATEGORÍA DE TRABAJOS": ["CATEGORIA DE TRABAJOS"],
+    "TIPO DE MANTENIMIENTO / INSPECCIÓN": [
+        "TIPO DE MANTENIMIENTO / INSPECCION",
+        "TIPO DE MANTENIMIENTO", "TIPO DE INSPECCION",
+    ],
+
+    # con y sin "DE"
+    "N° REGISTRO DE FALLA": ["N° REGISTRO FALLA", "N REGISTRO FALLA", "NUMERO REGISTRO FALLA"],
+
+    "CATEGORÍA DE RIESGO": ["CATEGORIA DE RIESGO"],
+    "DESCRIPCIÓN DE ACTIVIDAD": ["DESCRIPCION DE ACTIVIDAD", "DESCRIPCION", "ACTIVIDAD"],
+    "DESENERGIZACIONES": ["DESENERGIZACIONES", "DESENERGIZACION"],
+
+    # con asterisco o “DE LA ZONA”
+    "VEHÍCULO": ["VEHICULO", "VEHICULOS", "VEHICULO "],
+    "ILUMINACIÓN PARCIAL": ["ILUMINACION PARCIAL", "ILUMINACION PARCIAL DE LA ZONA"],
+    "SEÑALETICA PROPIA": ["SENALETICA PROPIA", "SENHALETICA PROPIA", "SEÑALÉTICA PROPIA"],
+
+    "R1": ["R1"], "R2": ["R2"], "P1": ["P1"], "P3": ["P3"], "E1": ["E1"], "V3": ["V3"],
+    "P6": ["P6"], "P7": ["P7"], "P8": ["P8"],
+
+    "BLOQUEO DE VÍA": ["BLOQUEO DE VIA", "BLOQUEO DE VÍA"],
+    "DESDE": ["DESDE"],
+    "HASTA": ["HASTA"],
+
+    "Seleccionar etiqueta": ["SELECCIONAR ETIQUETA", "ETIQUETA"],
+}
+
+def _build_alias_index(aliases: dict) -> dict:
+    """Índice `clave normalizada -> (canónico, prioridad)`; la prioridad es el orden de la
+    variante en su lista (el canónico va al final). Ante choques gana el primer canónico."""
+    index = {}
+    for canon, variants in aliases.items():
+        for rank, v in enumerate(variants + [canon]):  # variantes + el canónico
+            index.setdefault(_normalize_key(v), (canon, rank))
+    return index
+
+ALIAS_INDEX = _build_alias_index(ALIASES)
+
+def apply_aliases(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty: return df
+    norm_cols = {_normalize_key(c): c for c in df.columns}
+    best = {}  # canónico -> (prioridad, columna original)
+    for nk, col in norm_cols.items():
+        hit = ALIAS_INDEX.get(nk)
+        if hit and (hit[0] not in best or hit[1] < best[hit[0]][0]):
+            best[hit[0]] = (hit[1], col)
+    rename_map = {col: canon for canon, (_, col) in best.items()}
+    if rename_map:
+        df = df.rename(columns=rename_map)
+    return df
+
+HEADER_SCAN_ROWS = 60   # filas revisadas (por hoja) al buscar el encabezado sin tabla
+HEADER_SCAN_COLS = 256  # columnas revisadas en esas filas
+HEADER_MIN_SCORE = 3    # columnas reconocidas mínimas para aceptar una fila como encabezado
+
+def _header_columns(values) -> set:
+    """Columnas canónicas distintas reconocidas en una fila."""
+    return {ALIAS_INDEX[nk][0] for nk in map(_normalize_key, values) if nk in ALIAS_INDEX}
+
+def score_header_row(values) -> int:
+    """Cantidad de columnas canónicas distintas reconocidas en una fila."""
+    return len(_header_columns(values))
+
+def find_header_row(rows) -> tuple[int | None, int]:
+    """Mejor fila de encabezado entre `rows` (listas de celdas): `(posición, puntaje)`.
+
+    Solo cuentan filas con al menos HEADER_MIN_SCORE columnas reconocidas y EMPRESA o
+    alguna obligatoria entre ellas: una celda suelta ("EMAIL", "DESDE") o una hoja de
+    instrucciones no deben tomarse por la tabla. Ante empate gana la primera; `(None, 0)`
+    si ninguna califica."""
+    anchors = {"EMPRESA", *REQUIRED_COLS}
+    best_i, best_score = None, 0
+    for i, values in enumerate(rows):
+        cols = _header_columns(v for v in values if v is not None)
+        if len(cols) < HEADER_MIN_SCORE or not cols & anchors: continue
+        if len(cols) > best_score:
+            best_i, best_score = i, len(cols)
+    return best_i, best_score
+
+# =============== Utilidades de Excel ===============
+EXCEL_CHUNK_ROWS = 5000  # filas por bloque al leer en streaming
+
+def _xml_local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+def _xml_attr(el, name: str):
+    """Atributo por nombre local (ignora el namespace, p.ej. `r:id`)."""
+    for k, v in el.attrib.items():
+        if _xml_local(k) == name: return v
+    return None
+
+def _zip_rels(zf: zipfile.ZipFile, part: str) -> dict:
+    """Relaciones (`Id` -> ruta absoluta en el zip) de una parte del paquete xlsx."""
+    folder, name = posixpath.split(part)
+    rels_path = posixpath.join(folder, "_rels", name + ".rels")
+    if rels_path not in zf.namelist(): return {}
+    out = {}
+    for el in ET.fromstring(zf.read(rels_path)):
+        target = el.get("Target") or ""
+        if el.get("TargetMode") == "External" or not target: continue
+        path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        out[el.get("Id")] = path
+    return out
+
+def _find_table_ref(bio, table_name: str) -> tuple[str, str] | None:
+    """Ubica la tabla leyendo solo las partes XML del zip: devuelve `(hoja, ref)` o None."""
+    try:
+        with zipfile.ZipFile(bio) as zf:
+            wb_part = "xl/workbook.xml"
+            wb_rels = _zip_rels(zf, wb_part)
+            for sheet in ET.fromstring(zf.read(wb_part)).iter():
+                if _xml_local(sheet.tag) != "sheet": continue
+                sheet_part = wb_rels.get(_xml_attr(sheet, "id"))
+                if not sheet_part: continue
+                for tpart in _zip_rels(zf, sheet_part).values():
+                    if "/tables/" not in tpart or tpart not in zf.namelist(): continue
+                    t = ET.fromstring(zf.read(tpart))
+                    names = {(t.get("name") or "").strip().lower(), (t.get("displayName") or "").strip().lower()}
+                    if table_name.lower() in names and t.get("ref"):
+                        return sheet.get("name"), t.get("ref")
+    except (zipfile.BadZipFile, KeyError, ET.ParseError):
+        return None
+    finally:
+        bio.seek(0)
+    return None
+
+def _clean_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """Quita columnas sin encabezado, recorta textos y descarta filas vacías."""
+    df = df.loc[:, [c for c in df.columns if str(c).strip() and not str(c).startswith("Unnamed")]]
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].apply(lambda x: x.strip() if isinstance(x, str) else x)
+    return df.dropna(how="all")
+
+def _header_names(values) -> list[str]:
+    return [str(h).strip() if h is not None else "" for h in values]
+
+def _row_chunks(rows, header: list, chunk_size: int, start: int = 0):
+    """Agrupa `rows` (tuplas de celdas) en DataFrames de hasta `chunk_size` filas con `header`.
+
+    El índice es la posición de cada fila contando desde `start`. Las filas sin ninguna
+    celda se saltan antes de armar el DataFrame (las planillas suelen arrastrar miles de
+    filas con solo formato). Las columnas quedan como object, con los valores de las celdas
+    tal cual: inferir tipos por bloque haría que el mismo valor cambie según el bloque.
+    Siempre entrega al menos un bloque, aunque sea vacío."""
+    metrics = get_metrics()
+    width = len(header)
+    # Solo cuenta el tiempo propio del generador, no el de quien consume los bloques
+    t0 = time.perf_counter()
+    buf, idx, emitted = [], [], False
+    for pos, r in enumerate(rows, start):
+        if r.count(None) == len(r): continue
+        r = list(r[:width])
+        buf.append(r + [None] * (width - len(r)) if len(r) < width else r)
+        idx.append(pos)
+        if len(buf) >= chunk_size:
+            chunk = _clean_chunk(pd.DataFrame(buf, columns=header, index=idx, dtype=object))
+            metrics.observe_phase("table_extraction", time.perf_counter() - t0, len(buf))
+            yield chunk
+            emitted = True
+            t0 = time.perf_counter()
+            buf, idx = [], []
+    if buf or not emitted:
+        chunk = _clean_chunk(pd.DataFrame(buf, columns=header, index=pd.Index(idx, dtype="int64"), dtype=object))
+        metrics.observe_phase("table_extraction", time.perf_counter() - t0, len(buf))
+        yield chunk
+
+def iter_table_chunks(uploaded_bytes: bytes, table_name: str = "SIOT", chunk_size: int = EXCEL_CHUNK_ROWS):
+    """Lee la tabla en modo read-only y genera DataFrames de hasta `chunk_size` filas.
+
+    La memoria queda acotada por el bloque, no por el libro. El índice es la posición
+    de la fila dentro de la tabla. Si la tabla no existe no genera nada."""
+    metrics = get_metrics()
+    bio = io.BytesIO(uploaded_bytes)
+    with metrics.timer("workbook_load"):
+        found = _find_table_ref(bio, table_name)
+        if not found: return
+        sheet_name, ref = found
+        min_col, min_row, max_col, max_row = range_boundaries(ref)
+        wb = load_workbook(bio, data_only=True, read_only=True)
+    try:
+        rows = wb[sheet_name].iter_rows(min_row=min_row, max_row=max_row,
+                                        min_col=min_col, max_col=max_col, values_only=True)
+        first = next(rows, None)
+        if first is None: return
+        yield from _row_chunks(rows, _header_names(first), chunk_size)
+    finally:
+        wb.close()
+
+def _scan_header(ws) -> tuple[int | None, int, tuple]:
+    """Mejor encabezado entre las primeras HEADER_SCAN_ROWS filas de una hoja read-only:
+    `(posición, puntaje, celdas)`. Lee solo ese prefijo de la hoja."""
+    # `<dimension>` suele declarar el rango con formato (p.ej. A1:XFD1048576): se ignora
+    # y el ancho se acota a mano para no rellenar filas con miles de celdas vacías
+    ws.reset_dimensions()
+    rows = list(ws.iter_rows(min_row=1, max_row=HEADER_SCAN_ROWS, max_col=HEADER_SCAN_COLS, values_only=True))
+    i, score = find_header_row(rows)
+    return i, score, (rows[i] if i is not None else ())
+
+def iter_header_chunks(uploaded_bytes: bytes, chunk_size: int = EXCEL_CHUNK_ROWS):
+    """Fallback sin tabla: busca el encabezado en el inicio de cada hoja, elige la hoja con
+    más columnas reconocidas (ante empate, la primera) y lee por bloques solo las filas
+    debajo de él, hasta la última columna con encabezado.
+
+    El índice es la fila de Excel menos 1. No genera nada si ninguna hoja tiene un
+    encabezado reconocible."""
+    metrics = get_metrics()
+    with metrics.timer("workbook_load"):
+        wb = load_workbook(io.BytesIO(uploaded_bytes), data_only=True, read_only=True)
+    try:
+        with metrics.timer("header_scan"):
+            best = None  # (puntaje, hoja, posición, celdas)
+            for ws in wb.worksheets:
+                i, score, cells = _scan_header(ws)
+                if i is not None and (best is None or score > best[0]):
+                    best = (score, ws, i, cells)
+        if best is None: return
+        _, ws, i, cells = best
+        header = _header_names(cells)
+        width = max(k + 1 for k, h in enumerate(header) if h)
+        rows = ws.iter_rows(min_row=i + 2, max_col=width, values_only=True)
+        yield from _row_chunks(rows, header[:width], chunk_size, start=i + 1)
+    finally:
+        wb.close()
+
+def read_excel_table_siot(uploaded_bytes: bytes, table_name: str = "SIOT") -> pd.DataFrame:
+    """Lee la tabla SIOT; si no existe, fallback por encabezado flexible."""
+    # 1) Intentar tabla SIOT (streaming read-only sobre su rango)
+    chunks = list(iter_table_chunks(uploaded_bytes, table_name))
+    # 2) Fallback: la hoja y fila (de las primeras) que más columnas conocidas reconoce
+    if not chunks: chunks = list(iter_header_chunks(uploaded_bytes))
+    if not chunks: return pd.DataFrame()
+    return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+# =============== Cliente HTTP Pipefy ===============
+class TokenBucket:
+    """Limitador de tasa: `rate` permisos/seg con ráfaga de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = max(float(rate), 1e-6)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta obtener un permiso."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self.rate = max(float(rate), 1e-6)
+
+class PipefyClient:
+    """Sesión HTTP compartida (pool de conexiones) con reintentos y tasa adaptativa.
+
+    Reintenta 429/5xx y errores de conexión respetando `Retry-After` (hasta
+    `max_retry_after` segundos; si pide más se devuelve la respuesta) o con backoff
+    exponencial con jitter. La tasa baja a la mitad cuando Pipefy limita y sube de a
+    poco con respuestas limpias, sin pasar de `max_rate`.
+
+    Las mutaciones (`idempotent=False`) solo se reintentan si la solicitud no llegó a
+    enviarse (timeout o rechazo al conectar) o con 429: tras un timeout de lectura o un
+    5xx Pipefy pudo haber creado la tarjeta, y reintentar la duplicaría."""
+
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, token: str, url: str = PIPEFY_API_URL, max_rate: float = PIPEFY_RATE_PER_SEC,
+                 max_retries: int = PIPEFY_MAX_RETRIES, pool_size: int = PIPEFY_MAX_IN_FLIGHT,
+                 max_retry_after: float = PIPEFY_MAX_RETRY_AFTER_SEC):
+        self.url = url
+        self.max_retry_after = max(0.0, float(max_retry_after))
+        self.max_rate = max(float(max_rate), 0.1)
+        self.min_rate = min(0.2, self.max_rate)
+        self.max_retries = max(0, int(max_retries))
+        self.bucket = TokenBucket(self.max_rate)
+        # Tope global de solicitudes simultáneas con este token (todas las sesiones/trabajos)
+        self._slots = threading.BoundedSemaphore(max(1, int(pool_size)))
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(4, int(pool_size) * 2))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _throttled(self):
+        self.bucket.set_rate(max(self.min_rate, self.bucket.rate * 0.5))
+
+    def _clean(self):
+        if self.bucket.rate < self.max_rate:
+            self.bucket.set_rate(min(self.max_rate, self.bucket.rate + self.max_rate * 0.05))
+
+    @staticmethod
+    def _retry_after(resp) -> float | None:
+        val = (resp.headers.get("Retry-After") or "").strip()
+        if not val: return None
+        try: return max(0.0, float(val))
+        except ValueError: pass
+        try: return max(0.0, (parsedate_to_datetime(val) - datetime.now(timezone.utc)).total_seconds())
+        except Exception: return None
+
+    @staticmethod
+    def _not_sent(e: Exception) -> bool:
+        """El error ocurrió antes de enviar la solicitud (Pipefy no la recibió)."""
+        if isinstance(e, requests.ConnectTimeout): return True
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(e, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def _backoff(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    def post(self, payload: dict, timeout: float = 40, op: str = "graphql", idempotent: bool = True,
+             max_retries: int | None = None):
+        """POST GraphQL con reintentos; devuelve la última respuesta o relanza el último error.
+        `op` etiqueta las métricas de latencia y estados HTTP; `max_retries` reemplaza el del cliente."""
+        metrics = get_metrics()
+        max_retries = self.max_retries if max_retries is None else max(0, int(max_retries))
+        t_call = time.perf_counter()
+        try:
+            for attempt in range(max_retries + 1):
+                if attempt: metrics.inc("siot_http_retries_total", op=op)
+                self.bucket.acquire()
+                t0 = time.perf_counter()
+                try:
+                    with self._slots:
+                        resp = self.session.post(self.url, json=payload, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    metrics.observe("siot_http_request_seconds", time.perf_counter() - t0, op=op)
+                    metrics.inc("siot_http_responses_total", op=op, status=type(e).__name__)
+                    if attempt >= max_retries or not (idempotent or self._not_sent(e)): raise
+                    time.sleep(self._backoff(attempt))
+                    continue
+                metrics.observe("siot_http_request_seconds", time.perf_counter() - t0, op=op)
+                metrics.inc("siot_http_responses_total", op=op, status=resp.status_code)
+                if resp.status_code not in self.RETRY_STATUS:
+                    self._clean()
+                    return resp
+                if resp.status_code in (429, 503): self._throttled()
+                if attempt >= max_retries or not (idempotent or resp.status_code == 429): return resp
+                wait = self._retry_after(resp)
+                # Un Retry-After largo bloquearía el hilo (y el slot del pool) por horas
+                if wait is not None and wait > self.max_retry_after: return resp
+                time.sleep(max(wait if wait is not None else 0.0, self._backoff(attempt)))
+            return resp
+        finally:
+            metrics.observe("siot_pipefy_call_seconds", time.perf_counter() - t_call, op=op)
+
+@functools.lru_cache(maxsize=None)
+def get_pipefy_client(token: str, url: str = PIPEFY_API_URL) -> PipefyClient:
+    """Un cliente por token/URL, compartido entre reruns y sesiones."""
+    return PipefyClient(token, url)
+
+# =============== Utilidades de campos/fechas/labels ===============
+def _parse_multi(val):
+    if val is None: return None
+    try:
+        if isinstance(val, float) and pd.isna(val): return None
+    except Exception: pass
+    if isinstance(val, (list, tuple, set)):
+        out = [str(x).strip() for x in val if str(x).strip() not in ("", "nan")]
+        return out or None
+    s = str(val).strip()
+    if not s or s.lower() == "nan": return None
+    return [p.strip() for p in s.replace(",", ";").split(";") if p.strip()] or None
+
+def _fetch_labels_map(token: str, pipe_id: int) -> dict | None:
+    """Etiquetas del pipe (`nombre -> id`); None si la consulta falla."""
+    q = {"query": "query($id: ID!){ pipe(id:$id){ labels{ id name } } }", "variables": {"id": pipe_id}}
+    try:
+        r = get_pipefy_client(token).post(q, timeout=30, op="labels")
+        if r.status_code != 200: return None
+        body = r.json()
+        if body.get("errors"): return None
+        data = body["data"]["pipe"]["labels"] or []
+        return {x["name"]: x["id"] for x in data if "id" in x and "name" in x}
+    except Exception:
+        return None
+
+# -------- Caché de etiquetas por pipe (compartida entre sesiones) --------
+LABELS_TTL_SEC = float(str(get_secret("LABELS_TTL_SEC", "300")) or "300")
+LABELS_REFRESH_AHEAD = 0.8  # fracción del TTL a partir de la cual se refresca en segundo plano
+LABELS_FAILURE_TTL_SEC = float(str(get_secret("LABELS_FAILURE_TTL_SEC", "30")) or "30")  # no reconsultar tras un fallo
+
+class LabelsUnavailableError(RuntimeError):
+    """No se pudieron obtener las etiquetas y no hay copia previa en caché."""
+
+class LabelsCache:
+    """Caché TTL de `_fetch_labels_map` por `pipe_id`.
+
+    - Sesiones concurrentes sobre el mismo pipe comparten una sola consulta.
+    - Cerca del vencimiento se refresca en segundo plano sin bloquear.
+    - Si la consulta falla se sirve la copia vencida (stale-while-error), y durante
+      `failure_ttl` segundos no se vuelve a consultar (sin copia, falla de inmediato)."""
+
+    what = "las etiquetas"  # para el mensaje de error
+
+    def __init__(self, ttl: float = LABELS_TTL_SEC, fetch=None, failure_ttl: float = LABELS_FAILURE_TTL_SEC):
+        self.ttl = max(float(ttl), 0.0)
+        self.failure_ttl = max(float(failure_ttl), 0.0)
+        self._fetch = fetch or _fetch_labels_map
+        self._entries = {}       # pipe_id -> (labels_map, monotonic de la consulta)
+        self._failed = {}        # pipe_id -> monotonic del último fallo
+        self._pipe_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _pipe_lock(self, pipe_id) -> threading.Lock:
+        with self._lock:
+            return self._pipe_locks.setdefault(pipe_id, threading.Lock())
+
+    def _is_fresh(self, entry) -> bool:
+        return entry is not None and time.monotonic() - entry[1] < self.ttl
+
+    def _recently_failed(self, pipe_id) -> bool:
+        failed = self._failed.get(pipe_id)
+        return failed is not None and time.monotonic() - failed < self.failure_ttl
+
+    def _load(self, token: str, pipe_id):
+        labels = self._fetch(token, pipe_id)
+        with self._lock:
+            if labels is not None:
+                self._entries[pipe_id] = (labels, time.monotonic())
+                self._failed.pop(pipe_id, None)
+            else:
+                self._failed[pipe_id] = time.monotonic()
+        return labels
+
+    def _refresh_in_background(self, token: str, pipe_id):
+        with self._lock:
+            if pipe_id in self._refreshing: return
+            self._refreshing.add(pipe_id)
+
+        def _run():
+            try:
+                with self._pipe_lock(pipe_id): self._load(token, pipe_id)
+            finally:
+                with self._lock: self._refreshing.discard(pipe_id)
+        threading.Thread(target=_run, name=f"labels-refresh-{pipe_id}", daemon=True).start()
+
+    def get(self, token: str, pipe_id) -> dict:
+        entry = self._entries.get(pipe_id)
+        if self._is_fresh(entry):
+            if time.monotonic() - entry[1] > self.ttl * LABELS_REFRESH_AHEAD:
+                self._refresh_in_background(token, pipe_id)
+            return entry[0]
+        with self._pipe_lock(pipe_id):
+            entry = self._entries.get(pipe_id)  # otro hilo pudo haberlo cargado mientras esperábamos
+            if self._is_fresh(entry): return entry[0]
+            labels = None if self._recently_failed(pipe_id) else self._load(token, pipe_id)
+        if labels is not None: return labels
+        if entry is not None: return entry[0]
+        raise LabelsUnavailableError(f"No se pudieron obtener {self.what} del pipe {pipe_id}.")
+
+    def invalidate(self, pipe_id=None):
+        """Descarta la caché de un pipe (o de todos si `pipe_id` es None)."""
+        with self._lock:
+            if pipe_id is None:
+                self._entries.clear()
+                self._failed.clear()
+            else:
+                self._entries.pop(pipe_id, None)
+                self._failed.pop(pipe_id, None)
+
+@functools.lru_cache(maxsize=None)
+def get_labels_cache() -> LabelsCache:
+    return LabelsCache()
+
+class CardError(str):
+    """Mensaje de error de una tarjeta (se usa como `str`); `status` es el código HTTP
+    de la respuesta, o None si no la hubo (timeout, conexión, excepción)."""
+
+    def __new__(cls, message: str, status: int | None = None):
+        obj = super().__new__(cls, message)
+        obj.status = status
+        return obj
+
+def _http_error(resp) -> CardError:
+    return CardError(f"HTTP {resp.status_code}: {resp.text[:500]}", resp.status_code)
+
+def pipefy_create_card(token: str, pipe_id: int, fields_attrs: list, title: str):
+    mutation = {
+        "query": """
+        mutation($input: CreateCardInput!) {
+          createCard(input: $input) { card { id title } }
+        }
+        """,
+        "variables": {"input": {"pipe_id": pipe_id, "title": title, "fields_attributes": fields_attrs}},
+    }
+    try:
+        resp = get_pipefy_client(token).post(mutation, timeout=40, op="create_card", idempotent=False)
+        if resp.status_code != 200: return False, _http_error(resp)
+        data = resp.json()
+        if "errors" in data: return False, CardError(str(data["errors"]), resp.status_code)
+        return True, data.get("data", {}).get("createCard", {}).get("card", {}).get("id")
+    except Exception as e:
+        return False, CardError(str(e))
+
+def pipefy_create_cards_batch(token: str, pipe_id: int, items: list) -> list:
+    """Crea varias tarjetas en una sola solicitud con alias `c0: createCard(...)`, `c1: ...`.
+
+    `items` es una lista de `(fields_attrs, title)`; devuelve un `(ok, info)` por item,
+    en el mismo orden. Los errores de GraphQL se asignan a su fila según `path[0]`."""
+    if not items: return []
+    var_defs = ", ".join(f"$i{k}: CreateCardInput!" for k in range(len(items)))
+    ops = "\n".join(f"c{k}: createCard(input: $i{k}) {{ card {{ id title }} }}" for k in range(len(items)))
+    mutation = {
+        "query": f"mutation({var_defs}) {{\n{ops}\n}}",
+        "variables": {
+            f"i{k}": {"pipe_id": pipe_id, "title": title, "fields_attributes": fields_attrs}
+            for k, (fields_attrs, title) in enumerate(items)
+        },
+    }
+    try:
+        resp = get_pipefy_client(token).post(mutation, timeout=40 + 5 * len(items), op="create_cards_batch",
+                                             idempotent=False)
+        if resp.status_code != 200: return [(False, _http_error(resp))] * len(items)
+        data = resp.json()
+    except Exception as e:
+        return [(False, CardError(str(e)))] * len(items)
+    if not isinstance(data, dict):
+        return [(False, CardError(f"Respuesta inesperada: {str(data)[:500]}", resp.status_code))] * len(items)
+
+    payload = data.get("data") if isinstance(data.get("data"), dict) else {}
+    errors = data.get("errors") if isinstance(data.get("errors"), list) else []
+    aliases = [f"c{k}" for k in range(len(items))]
+    errs_by_alias, global_errs = {}, []
+    for err in errors:
+        path = (err.get("path") or []) if isinstance(err, dict) else []
+        if path and str(path[0]) in aliases:
+            errs_by_alias.setdefault(str(path[0]), []).append(err)
+        else:
+            global_errs.append(err)
+
+    out = []
+    for alias in aliases:
+        result = payload.get(alias)
+        card = result.get("card") if isinstance(result, dict) else None
+        card = card if isinstance(card, dict) else {}
+        if alias in errs_by_alias:
+            out.append((False, CardError(str(errs_by_alias[alias]), resp.status_code)))
+        elif card.get("id"):
+            out.append((True, card.get("id")))
+        else:
+            out.append((False, CardError(str(global_errs or "Respuesta sin tarjeta"), resp.status_code)))
+    return out
+
+# =============== Normalización de fechas/horas ===============
+# Formatos candidatos, en orden de preferencia ante empate (día/mes antes que mes/día)
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y", "%Y/%m/%d", "%d/%m/%y", "%Y-%m-%d %H:%M:%S")
+TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M:%S %p", "%I:%M%p", "%Y-%m-%d %H:%M:%S", "%H.%M")
+FORMAT_SAMPLE_SIZE = 500          # valores distintos usados para inferir el formato dominante
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+EXCEL_MAX_SERIAL = 2958465        # 9999-12-31
+
+_DT_TYPES = {datetime, date, pd.Timestamp}
+_NUM_TYPES = {int, float, np.int64, np.int32, np.float64, np.float32}
+
+def _parse_strings(uniques: pd.Series, formats) -> pd.Series:
+    """Parsea textos (ya únicos) con el formato que más acierta en una muestra;
+    los que no calzan se reintentan con los demás formatos, solo sobre ese resto."""
+    sample = uniques.iloc[:FORMAT_SAMPLE_SIZE]
+    hits = [int(pd.to_datetime(sample, format=f, errors="coerce").notna().sum()) for f in formats]
+    ranked = [f for _, _, f in sorted(((-h, k, f) for k, (h, f) in enumerate(zip(hits, formats))))]
+    out = pd.Series(pd.NaT, index=uniques.index, dtype="datetime64[ns]")
+    todo = np.ones(len(uniques), dtype=bool)
+    for fmt in ranked:
+        if not todo.any(): break
+        parsed = pd.to_datetime(uniques[todo], format=fmt, errors="coerce")
+        hit = parsed.notna().to_numpy()
+        pos = np.flatnonzero(todo)[hit]
+        out.iloc[pos] = parsed.to_numpy()[hit]
+        todo[pos] = False
+    return out
+
+def normalize_temporal(col: pd.Series, kind: str) -> tuple[pd.Series, np.ndarray]:
+    """Normaliza una columna completa: fechas (`kind="date"`) a YYYY-MM-DD y horas
+    (`kind="time"`) a HH:MM, incluyendo seriales de Excel.
+
+    Devuelve `(columna, no_interpretadas)`: las celdas que no se pudieron interpretar
+    conservan su valor original y quedan marcadas en la máscara."""
+    fmt_out = "%Y-%m-%d" if kind == "date" else "%H:%M"
+    vals = col.to_numpy(dtype=object)
+    res = np.full(len(vals), None, dtype=object)
+    if pd.api.types.is_datetime64_any_dtype(col.dtype):
+        ok = col.notna().to_numpy()
+        res[ok] = col[ok].dt.strftime(fmt_out).to_numpy()
+        return pd.Series(res, index=col.index), np.zeros(len(vals), dtype=bool)
+
+    types = pd.Series(vals).map(type)
+    na = pd.isna(vals)
+    done = na.copy()
+
+    # 1) Objetos fecha/hora ya tipados (celdas con formato fecha en Excel)
+    m = (types.isin(_DT_TYPES).to_numpy()) & ~na
+    if m.any():
+        parsed = pd.to_datetime(pd.Series(vals[m]), errors="coerce")
+        conv = parsed.dt.strftime(fmt_out).to_numpy(dtype=object)
+        # Fuera del rango de pandas (p.ej. año 3024 por error de tipeo): se formatea cada objeto
+        for k in np.flatnonzero(parsed.isna().to_numpy()):
+            try: conv[k] = vals[m][k].strftime(fmt_out)
+            except (ValueError, AttributeError): conv[k] = None
+        pos = np.flatnonzero(m)
+        ok = np.array([c is not None for c in conv], dtype=bool)
+        res[pos[ok]] = conv[ok]
+        done[pos[ok]] = True
+    if kind == "time":
+        m = types.eq(dtime).to_numpy() & ~na
+        if m.any():
+            res[m] = [f"{t.hour:02d}:{t.minute:02d}" for t in vals[m]]
+            done |= m
+
+    # 2) Números: seriales de Excel (días desde 1899-12-30; la fracción es la hora)
+    m = types.isin(_NUM_TYPES).to_numpy() & ~na
+    if m.any():
+        num = vals[m].astype(float)
+        if kind == "date":
+            ok = (num >= 1) & (num <= EXCEL_MAX_SERIAL)
+            # En días (datetime64[D]) cabe hasta 9999-12-31; en ns solo hasta 2262
+            days = np.datetime64(EXCEL_EPOCH.date(), "D") + np.floor(num[ok]).astype("timedelta64[D]")
+            conv = np.datetime_as_string(days, unit="D")
+        else:
+            frac = num % 1
+            ok = (num >= 0) & ((num < 1) | (frac > 0))
+            minutes = np.rint(frac[ok] * 1440).astype(int) % 1440
+            conv = [f"{h:02d}:{mm:02d}" for h, mm in zip(minutes // 60, minutes % 60)]
+        pos = np.flatnonzero(m)[ok]
+        res[pos] = list(conv)
+        done[pos] = True
+
+    # 3) Textos: se parsea cada valor distinto una sola vez
+    m = types.eq(str).to_numpy() & ~done
+    if m.any():
+        txt = pd.Series(vals[m]).str.strip()
+        blank = txt.eq("").to_numpy() | txt.str.lower().eq("nan").to_numpy()
+        pos_blank = np.flatnonzero(m)[blank]
+        done[pos_blank] = True
+        pos = np.flatnonzero(m)[~blank]
+        if len(pos):
+            codes, uniques = pd.factorize(txt[~blank])
+            parsed = _parse_strings(pd.Series(uniques), DATE_FORMATS if kind == "date" else TIME_FORMATS)
+            out_u = parsed.dt.strftime(fmt_out).to_numpy(dtype=object)
+            ok_u = parsed.notna().to_numpy()
+            ok = ok_u[codes]
+            res[pos[ok]] = out_u[codes][ok]
+            done[pos[ok]] = True
+            res[pos[~ok]] = txt[~blank].to_numpy(dtype=object)[~ok]
+
+    unparsed = ~done
+    keep = unparsed & pd.isna(res)
+    res[keep] = vals[keep]
+    return pd.Series(res, index=col.index), unparsed
+
+def row_numbers(index: pd.Index) -> np.ndarray:
+    """Número de fila para reportes (índice + 1 si el índice es entero)."""
+    return index.to_numpy() + 1 if pd.api.types.is_integer_dtype(index) else index.to_numpy()
+
+def normalize_temporal_columns(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Aplica `normalize_temporal` a las columnas de tipo date/time del FIELD_MAP.
+
+    Devuelve `(df, no_interpretadas)` con el detalle `fila, columna, valor`."""
+    report = []
+    out = df
+    for f in COMPILED_FIELDS:
+        if f.kind not in ("date", "time") or f.column not in df.columns: continue
+        if out is df: out = df.copy()
+        col, bad = normalize_temporal(_first_col(df, f.column), f.kind)
+        out[f.column] = col
+        if bad.any():
+            report.append(pd.DataFrame({"fila": row_numbers(df.index[bad]), "columna": f.column,
+                                        "valor": col[bad].astype(str).to_numpy()}))
+    report = pd.concat(report, ignore_index=True) if report else pd.DataFrame(columns=["fila", "columna", "valor"])
+    return out, report
+
+# =============== Mapeo columnas -> campos Pipefy ===============
+# Spec por defecto: columna canónica -> field_id de Pipefy y tipo de conversión.
+# Tipos: "text" (texto recortado), "date" (YYYY-MM-DD), "time" (HH:MM), "list" (checklist /
+# multiselect, separado por ';' o ','), "labels" (nombres de etiqueta -> ids del pipe).
+# Se puede reemplazar con el secret `FIELD_MAP` (JSON o lista TOML) o `FIELD_MAP_PATH` (archivo JSON).
+FIELD_MAP = [
+    # Texto/fecha/select
+    {"column": "EMPRESA",                            "field_id": "empresa",                           "type": "text"},
+    {"column": "CCU",                                "field_id": "ccu_1",                             "type": "text"},
+    {"column": "INTEGRANTES DE CUADRILLA",           "field_id": "integrantes_de_cuadrilla",          "type": "text"},
+    {"column": "CONTACTO CCU",                       "field_id": "contacto_coordinador_de_cuadrilla", "type": "text"},
+    {"column": "FECHA DE INICIO",                    "field_id": "fecha_de_inicio",                   "type": "date"},
+    {"column": "FECHA DE FIN",                       "field_id": "fecha_de_fin",                      "type": "date"},
+    {"column": "CANTÓN / ESTACIÓN",                  "field_id": "cant_n_estaci_n",                   "type": "text"},
+    {"column": "ZONA DE ESTACIÓN",                   "field_id": "zona_de_trabajo",                   "type": "text"},
+    {"column": "DESCRIPCIÓN DE ACTIVIDAD",           "field_id": "descripci_n_de_actividad",          "type": "text"},
+    {"column": "HORA DE INICIO",                     "field_id": "hora_de_inicio",                    "type": "time"},
+    {"column": "HORA DE FIN",                        "field_id": "hora_de_fin",                       "type": "time"},
+    {"column": "TIPO DE JORNADA",                    "field_id": "tipo_de_jornada",                   "type": "text"},
+    {"column": "TIPO DE MANTENIMIENTO / INSPECCIÓN", "field_id": "tipo_de_mantenimiento",             "type": "text"},
+    {"column": "N° REGISTRO DE FALLA",               "field_id": "registro_de_incidente",             "type": "text"},
+    {"column": "CATEGORÍA DE RIESGO",                "field_id": "categor_a_de_riesgo",               "type": "text"},
+    {"column": "CATEGORÍA DE TRABAJOS",              "field_id": "categor_a_de_trabajos",             "type": "text"},
+    {"column": "DESENERGIZACIONES",                  "field_id": "desenergizaci_n",                   "type": "text"},
+
+    # Checklists / multiselect
+    {"column": "VEHÍCULO",            "field_id": "veh_culo",                  "type": "list"},
+    {"column": "ILUMINACIÓN PARCIAL", "field_id": "iluminaci_n_parcia",        "type": "list"},
+    {"column": "SEÑALETICA PROPIA",   "field_id": "se_aletica_propia",         "type": "list"},
+    {"column": "R1",                  "field_id": "r1_1",                      "type": "list"},
+    {"column": "R2",                  "field_id": "r2_1",                      "type": "list"},
+    {"column": "P1",                  "field_id": "p1",                        "type": "list"},
+    {"column": "P3",                  "field_id": "p3",                        "type": "list"},
+    {"column": "E1",                  "field_id": "e1",                        "type": "list"},
+    {"column": "V3",                  "field_id": "v3",                        "type": "list"},
+    {"column": "P6",                  "field_id": "copy_of_se_aletica_propia", "type": "list"},
+    {"column": "P7",                  "field_id": "copy_of_r1",                "type": "list"},
+    {"column": "P8",                  "field_id": "copy_of_p3",                "type": "list"},
+
+    # Bloqueo de vía
+    {"column": "BLOQUEO DE VÍA", "field_id": "bloqueo_de_v_a_1", "type": "list"},
+    {"column": "DESDE",          "field_id": "bloqueo_desde",    "type": "text"},
+    {"column": "HASTA",          "field_id": "hasta",            "type": "text"},
+
+    # Etiquetas (label_select)
+    {"column": "Seleccionar etiqueta", "field_id": "seleccionar_etiqueta", "type": "labels"},
+
+    # Email solicitante (canónico que definimos)
+    {"column": "CORREO DEL SOLICITANTE", "field_id": "correo_electr_nico_del_solicitante", "type": "text"},
+]
+
+def load_field_map() -> list:
+    """Spec de campos desde secrets (`FIELD_MAP` / `FIELD_MAP_PATH`) o FIELD_MAP por defecto."""
+    path = get_secret("FIELD_MAP_PATH", "")
+    if path:
+        with open(path, encoding="utf-8") as f: return json.load(f)
+    raw = get_secret("FIELD_MAP", None)
+    if not raw: return FIELD_MAP
+    if isinstance(raw, str): return json.loads(raw)
+    return [dict(x) for x in raw]
+
+def _cell_text(x) -> str:
+    """Texto de una celda; los float enteros van sin decimales (7.0 -> "7"), así el valor
+    no depende de si pandas infirió la columna como float por tener celdas vacías."""
+    return str(int(x)) if isinstance(x, float) and x.is_integer() else str(x)
+
+def _text_codes(col: pd.Series) -> tuple[np.ndarray, list]:
+    """Columna como `(codes, textos)`: cada valor distinto se recorta una sola vez;
+    los vacíos o 'nan' quedan en None y las celdas NaN llevan código -1."""
+    s = col.map(_cell_text, na_action="ignore").to_numpy(dtype=object)
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    texts = [u.strip() for u in uniques]
+    return codes, [t if t and t.lower() != "nan" else None for t in texts]
+
+def _to_text(col: pd.Series) -> np.ndarray:
+    """Texto recortado por celda; None si está vacía o es 'nan'."""
+    codes, texts = _text_codes(col)
+    return np.array(texts + [None], dtype=object)[codes]
+
+def _apply_unique(encoded: tuple[np.ndarray, list], fn) -> tuple[np.ndarray, list]:
+    """Aplica `fn` una vez por valor distinto no vacío de un `(codes, valores)`."""
+    codes, values = encoded
+    return codes, [fn(v) if v is not None else None for v in values]
+
+# Cada convertidor recibe la columna completa y devuelve `(codes, valor por código)`
+def _conv_text(col, ctx):
+    return _text_codes(col)
+
+def _conv_date(col, ctx):
+    return _text_codes(normalize_temporal(col, "date")[0])
+
+def _conv_time(col, ctx):
+    return _text_codes(normalize_temporal(col, "time")[0])
+
+def _conv_list(col, ctx):
+    return _apply_unique(_text_codes(col), _parse_multi)
+
+def _conv_labels(col, ctx):
+    labels_map, missing = ctx["labels_map"], ctx["missing_labels"]
+
+    def _ids(val):
+        ids = []
+        for name in _parse_multi(val) or []:
+            if name in labels_map: ids.append(labels_map[name])
+            else: missing.append(name)
+        return ids or None
+
+    return _apply_unique(_text_codes(col), _ids)
+
+FIELD_CONVERTERS = {"text": _conv_text, "date": _conv_date, "time": _conv_time,
+                    "list": _conv_list, "labels": _conv_labels}
+
+class CompiledField(NamedTuple):
+    column: str
+    field_id: str
+    kind: str
+    convert: object  # (Series, ctx) -> (codes, valores por código)
+
+def compile_field_map(spec: list) -> list[CompiledField]:
+    """Valida la spec y la compila a convertidores por columna."""
+    compiled = []
+    for i, item in enumerate(spec):
+        try: column, field_id, kind = item["column"], item["field_id"], item.get("type", "text")
+        except (KeyError, TypeError): raise ValueError(f"FIELD_MAP[{i}]: se requieren 'column' y 'field_id'.")
+        if kind not in FIELD_CONVERTERS:
+            raise ValueError(f"FIELD_MAP[{i}]: tipo desconocido '{kind}' (válidos: {', '.join(FIELD_CONVERTERS)}).")
+        compiled.append(CompiledField(column, field_id, kind, FIELD_CONVERTERS[kind]))
+    return compiled
+
+FIELD_SPEC = load_field_map()
+COMPILED_FIELDS = compile_field_map(FIELD_SPEC)
+
+def build_payloads(df: pd.DataFrame, labels_map: dict, missing_labels: list,
+                   fields: list[CompiledField] = COMPILED_FIELDS) -> list[list]:
+    """`fields_attributes` de todas las filas de `df`, convirtiendo columna por columna."""
+    ctx = {"labels_map": labels_map, "missing_labels": missing_labels}
+    fields = [f for f in fields if f.column in df.columns]
+    matrix = np.empty((len(df), len(fields)), dtype=object)
+    for j, f in enumerate(fields):
+        codes, values = f.convert(_first_col(df, f.column), ctx)
+        # Un dict por valor distinto, compartido entre las filas que lo repiten (no mutar)
+        lut = np.empty(len(values) + 1, dtype=object)
+        for k, v in enumerate(values):
+            if v is not None: lut[k] = {"field_id": f.field_id, "field_value": v}
+        matrix[:, j] = lut[codes]
+    return [[d for d in row if d is not None] for row in matrix.tolist()]
+
+def needs_labels(df: pd.DataFrame, fields: list[CompiledField] = COMPILED_FIELDS) -> bool:
+    """Alguna columna de etiquetas tiene valores: solo entonces hacen falta las del pipe."""
+    return any(any(t is not None for t in _text_codes(_first_col(df, f.column))[1])
+               for f in fields if f.kind == "labels" and f.column in df.columns)
+
+def build_titles(df: pd.DataFrame, start: int = 1) -> list[str]:
+    """Título de cada tarjeta: EMPRESA o 'Fila N' (posición dentro de `df`, desde `start`)."""
+    emp = _to_text(_first_col(df, "EMPRESA")) if "EMPRESA" in df.columns else [None] * len(df)
+    return [e if e is not None else f"Fila {i}" for i, e in enumerate(emp, start=start)]
+
+# =============== Formulario de inicio (schema) y pre-validación ===============
+# Definición de los campos del formulario de inicio del pipe (tipo, obligatorio, opciones),
+# para rechazar localmente filas que Pipefy rechazaría y no gastar solicitudes en ellas.
+SCHEMA_TTL_SEC = float(str(get_secret("SCHEMA_TTL_SEC", "3600")) or "3600")
+SCHEMA_CACHE_PATH = str(get_secret("SCHEMA_CACHE_PATH", "siot_schema_cache.json") or "")  # vacío = solo memoria
+
+_RE_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s.]{2,}$")
+_RE_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_RE_TIME = re.compile(r"^\d{1,2}:\d{2}$")
+_OPTION_TYPES = {"select", "radio_vertical", "radio_horizontal"}
+_CHECKLIST_TYPES = {"checklist_vertical", "checklist_horizontal"}
+
+SCHEMA_FETCH_TIMEOUT_SEC = 10  # la consulta corre al dibujar la página: corta y sin reintentos
+
+def _fetch_form_schema(token: str, pipe_id: int) -> dict | None:
+    """Campos del formulario de inicio: `field_id -> {label, type, required, options}`; None si falla."""
+    q = {"query": "query($id: ID!){ pipe(id:$id){ start_form_fields{ id label type required options } } }",
+         "variables": {"id": pipe_id}}
+    try:
+        r = get_pipefy_client(token).post(q, timeout=SCHEMA_FETCH_TIMEOUT_SEC, op="start_form", max_retries=0)
+        if r.status_code != 200: return None
+        body = r.json()
+        if body.get("errors"): return None
+        fields = body["data"]["pipe"]["start_form_fields"] or []
+        return {f["id"]: {"label": f.get("label"), "type": f.get("type"), "required": bool(f.get("required")),
+                          "options": list(f.get("options") or [])} for f in fields if "id" in f}
+    except Exception:
+        return None
+
+class FormSchemaCache(LabelsCache):
+    """Como `LabelsCache` (TTL, una sola consulta, stale-while-error) pero además guardada
+    en un JSON en disco, así sobrevive a reinicios del servidor y la comparten la app y la CLI."""
+
+    what = "el formulario de inicio"
+
+    def __init__(self, ttl: float = SCHEMA_TTL_SEC, path: str = SCHEMA_CACHE_PATH, fetch=None):
+        super().__init__(ttl, fetch or _fetch_form_schema)
+        self.path = Path(path) if path else None
+        now_wall, now_mono = time.time(), time.monotonic()
+        for pipe_id, entry in self._read_disk().items():
+            # La antigüedad en disco (reloj de pared) se traslada al reloj monotónico de la caché
+            self._entries[int(pipe_id)] = (entry["fields"], now_mono - max(0.0, now_wall - entry["saved_at"]))
+
+    def _read_disk(self) -> dict:
+        if not self.path: return {}
+        try:
+            with open(self.path, encoding="utf-8") as f: return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self, token: str, pipe_id):
+        fields = super()._load(token, pipe_id)
+        if fields is not None and self.path:
+            try:
+                data = self._read_disk()
+                data[str(pipe_id)] = {"saved_at": time.time(), "fields": fields}
+                tmp = self.path.with_name(self.path.name + ".tmp")
+                tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+                os.replace(tmp, self.path)
+            except OSError:
+                pass
+        return fields
+
+@functools.lru_cache(maxsize=None)
+def get_form_schema_cache() -> FormSchemaCache:
+    return FormSchemaCache()
+
+def get_form_schema(token: str, pipe_id: int) -> dict | None:
+    """Schema del formulario de inicio (cacheado); None si no se pudo obtener."""
+    try: return get_form_schema_cache().get(token, pipe_id)
+    except LabelsUnavailableError: return None
+
+def _check_value(spec: dict, value) -> str | None:
+    """Motivo de rechazo de un valor ya convertido para Pipefy, o None si es válido."""
+    kind, options = spec.get("type"), spec.get("options") or []
+    if kind in _OPTION_TYPES | _CHECKLIST_TYPES and options:
+        bad = [v for v in (value if isinstance(value, list) else [value]) if v not in options]
+        if bad: return "opción no válida: " + ", ".join(map(str, bad))
+    elif kind == "email":
+        if not _RE_EMAIL.match(str(value)): return "correo mal formado"
+    elif kind == "date":
+        if not _RE_DATE.match(str(value)): return "fecha no reconocida"
+    elif kind == "time":
+        if not _RE_TIME.match(str(value)): return "hora no reconocida"
+    elif kind in ("number", "currency"):
+        try: float(str(value).replace(",", "."))
+        except ValueError: return "no es un número"
+    return None
+
+def schema_warnings(schema: dict, fields: list[CompiledField] = COMPILED_FIELDS) -> list[str]:
+    """Problemas de configuración (no de filas): campos mapeados que no están en el formulario
+    y obligatorios del formulario sin columna en el FIELD_MAP."""
+    mapped = {f.field_id for f in fields}
+    out = [f"El campo `{f.field_id}` ({f.column}) no existe en el formulario de inicio."
+           for f in fields if f.field_id not in schema]
+    out += [f"El formulario exige `{fid}` ({spec.get('label')}) y no está en el FIELD_MAP."
+            for fid, spec in schema.items() if spec.get("required") and fid not in mapped]
+    return out
+
+def prevalidate(df: pd.DataFrame, schema: dict, fields: list[CompiledField] = COMPILED_FIELDS):
+    """Revisa en bloque los valores que se enviarían contra el schema del formulario.
+
+    Usa los mismos convertidores que `build_payloads` y evalúa cada valor distinto una sola
+    vez por campo. Devuelve `(rechazos, ok_mask)`: `rechazos` con `fila, campo, valor, motivo`
+    y `ok_mask` alineada al índice de `df`."""
+    ok = np.ones(len(df), dtype=bool)
+    parts = []
+    ctx = {"labels_map": {}, "missing_labels": []}
+    for f in fields:
+        spec = schema.get(f.field_id)
+        if spec is None or f.kind == "labels": continue
+        if f.column not in df.columns:
+            if spec.get("required") and len(df):
+                ok[:] = False
+                parts.append(pd.DataFrame({"fila": row_numbers(df.index), "campo": f.column,
+                                           "valor": None, "motivo": "obligatorio en Pipefy"}))
+            continue
+        codes, values = f.convert(_first_col(df, f.column), ctx)
+        reasons = [_check_value(spec, v) if v is not None else None for v in values]
+        if spec.get("required"): reasons.append("obligatorio en Pipefy")  # código -1 = vacío
+        else: reasons.append(None)
+        bad_codes = np.array([r is not None for r in reasons])
+        bad = bad_codes[codes]
+        if not bad.any(): continue
+        ok &= ~bad
+        shown = [", ".join(map(str, v)) if isinstance(v, list) else v for v in values] + [None]
+        parts.append(pd.DataFrame({
+            "fila": row_numbers(df.index[bad]), "campo": f.column,
+            "valor": np.array(shown, dtype=object)[codes[bad]],
+            "motivo": np.array(reasons, dtype=object)[codes[bad]],
+        }))
+    rechazos = (pd.concat(parts, ignore_index=True).sort_values("fila", kind="stable", ignore_index=True)
+                if parts else pd.DataFrame(columns=["fila", "campo", "valor", "motivo"]))
+    return rechazos, pd.Series(ok, index=df.index)
+
+# =============== Envío concurrente ===============
+def submit_cards(jobs, send, max_in_flight: int = PIPEFY_MAX_IN_FLIGHT):
+    """Ejecuta `send(job)` en paralelo (máx. `max_in_flight` en vuelo) y entrega los
+    resultados en el mismo orden que `jobs`. La tasa la regula el `PipefyClient`."""
+    max_in_flight = max(1, int(max_in_flight))
+
+    def _run(job):
+        try: return send(job)
+        except Exception as e: return False, CardError(str(e))
+
+    # Ventana de 2x para que el pool no quede ocioso mientras se espera la fila más antigua
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for job in jobs:
+            pending.append(pool.submit(_run, job))
+            if len(pending) >= 2 * max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _chunked(iterable, size: int):
+    buf = []
+    for x in iterable:
+        buf.append(x)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf: yield buf
+
+def upload_cards(jobs, token: str, pipe_id: int, batch_size: int = PIPEFY_BATCH_SIZE, **kw):
+    """Sube `(fields_attrs, title)` y entrega un `(ok, info)` por fila, en orden.
+    Con `batch_size > 1` agrupa varias tarjetas por solicitud."""
+    if batch_size <= 1:
+        yield from submit_cards(jobs, lambda j: pipefy_create_card(token, pipe_id, j[0], j[1]), **kw)
+        return
+    def _send(batch):
+        # Un resultado por fila aunque falle el lote entero (si no, se desalinean filas y resultados)
+        try: return pipefy_create_cards_batch(token, pipe_id, batch)
+        except Exception as e: return [(False, CardError(str(e)))] * len(batch)
+
+    for results in submit_cards(_chunked(jobs, batch_size), _send, **kw):
+        yield from results
+
+# =============== Bitácora de envíos (reanudable / idempotente) ===============
+JOURNAL_PATH = str(get_secret("JOURNAL_PATH", "siot_journal.sqlite3") or "siot_journal.sqlite3")
+
+def row_keys(df: pd.DataFrame, pipe_id: int, fields: list | None = None, seen: dict | None = None) -> list[str]:
+    """Clave estable por fila: hash del pipe y de los valores normalizados de las columnas
+    mapeadas. Filas idénticas dentro del mismo archivo se distinguen por su ocurrencia;
+    `seen` permite seguir la cuenta entre bloques del mismo archivo."""
+    fields = COMPILED_FIELDS if fields is None else fields
+    cols = [(f.column, _to_text(_first_col(df, f.column))) for f in fields if f.column in df.columns]
+    seen = {} if seen is None else seen
+    keys = []
+    for i in range(len(df)):
+        base = json.dumps([pipe_id] + [[c, v[i]] for c, v in cols], ensure_ascii=False)
+        h = hashlib.sha1(base.encode("utf-8")).digest()  # la cuenta se guarda por hash, no por texto
+        n = seen[h] = seen.get(h, -1) + 1
+        keys.append(hashlib.sha256(f"{base}#{n}".encode("utf-8")).hexdigest())
+    return keys
+
+class UploadJournal:
+    """Registro persistente (SQLite) de qué filas ya son tarjetas en cada pipe.
+
+    Estados: `pending` (enviada, sin respuesta registrada), `done` (con `card_id`) y
+    `failed` (con el último error). Una nueva subida omite las `done`."""
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS upload_journal (
+                    pipe_id    INTEGER NOT NULL,
+                    row_key    TEXT    NOT NULL,
+                    status     TEXT    NOT NULL,
+                    card_id    TEXT,
+                    error      TEXT,
+                    attempts   INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL    NOT NULL,
+                    PRIMARY KEY (pipe_id, row_key)
+                )""")
+
+    def lookup(self, pipe_id: int, keys: list[str]) -> dict:
+        """`row_key -> (status, card_id)` de las claves conocidas."""
+        out = {}
+        with self._lock:
+            for k in range(0, len(keys), 500):  # límite de parámetros de SQLite
+                part = keys[k:k + 500]
+                q = f"SELECT row_key, status, card_id FROM upload_journal WHERE pipe_id=? AND row_key IN ({','.join('?' * len(part))})"
+                for key, status, card_id in self._conn.execute(q, [pipe_id, *part]):
+                    out[key] = (status, card_id)
+        return out
+
+    def mark_pending(self, pipe_id: int, keys: list[str]):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO upload_journal (pipe_id, row_key, status, attempts, updated_at)
+                VALUES (?, ?, 'pending', 0, ?)
+                ON CONFLICT(pipe_id, row_key) DO UPDATE SET status='pending', updated_at=excluded.updated_at
+                WHERE status != 'done'""", [(pipe_id, k, now) for k in keys])
+
+    def record(self, pipe_id: int, key: str, ok: bool, info):
+        """Guarda el resultado de `pipefy_create_card` para una fila."""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                UPDATE upload_journal
+                   SET status=?, card_id=?, error=?, attempts=attempts+1, updated_at=?
+                 WHERE pipe_id=? AND row_key=?""",
+                ("done" if ok else "failed", str(info) if ok else None, None if ok else str(info)[:2000],
+                 time.time(), pipe_id, key))
+
+@functools.lru_cache(maxsize=None)
+def get_upload_journal(path: str = JOURNAL_PATH) -> UploadJournal:
+    return UploadJournal(path)
+
+def pending_positions(estados: list, retry_failed_only: bool = False, omitir=()) -> list[int]:
+    """Posiciones a enviar según el estado en la bitácora: todo lo que no está `done`
+    (o solo lo `failed`), menos las posiciones en `omitir`."""
+    omitir = set(omitir)
+    return [i for i, e in enumerate(estados)
+            if (e == "failed" if retry_failed_only else e != "done") and i not in omitir]
+
+class RowSelection(NamedTuple):
+    keys: list          # `row_keys` por fila
+    filas: list         # número de fila para reportes
+    estados: list       # estado en la bitácora ("" si nunca se envió)
+    rechazos: pd.DataFrame | None  # detalle de `prevalidate` (None sin formulario)
+    rechazadas: list    # posiciones que el formulario rechazaría (sin las ya subidas)
+    duplicados: list    # (posición, card_id) ya existentes en el pipe (sin las ya subidas ni omitidas)
+    omitir: set         # posiciones que no se envían
+
+    def positions(self, retry_failed_only: bool = False) -> list[int]:
+        return pending_positions(self.estados, retry_failed_only=retry_failed_only, omitir=self.omitir)
+
+def select_rows(df: pd.DataFrame, pipe_id: int, journal: UploadJournal, keys: list | None = None,
+                seen: dict | None = None, schema: dict | None = None, existentes: list | None = None,
+                skip_rejected: bool = True, skip_existing: bool = True) -> RowSelection:
+    """Qué filas válidas de `df` enviar: bitácora, pre-validación contra `schema` y
+    `existentes` (card_id o None por fila). Una fila rechazada que se omite no se informa
+    además como duplicada. `keys`/`seen` como en `row_keys`."""
+    keys = row_keys(df, pipe_id, seen=seen) if keys is None else keys
+    estado = journal.lookup(pipe_id, keys)
+    estados = [estado.get(k, ("", None))[0] for k in keys]
+    rechazos, rechazadas = None, []
+    if schema:
+        rechazos, ok = prevalidate(df, schema)
+        rechazadas = [p for p in np.flatnonzero(~ok.to_numpy()).tolist() if estados[p] != "done"]
+    omitir = set(rechazadas) if skip_rejected else set()
+    duplicados = [(p, cid) for p, cid in enumerate(existentes or ())
+                  if cid is not None and estados[p] != "done" and p not in omitir]
+    if skip_existing: omitir |= {p for p, _ in duplicados}
+    return RowSelection(keys, row_numbers(df.index).tolist(), estados, rechazos, rechazadas, duplicados, omitir)
+
+# =============== Duplicados contra tarjetas existentes ===============
+DEDUP_KEY_COLUMNS = _secret_list("DEDUP_KEY_COLUMNS", [
+    "EMPRESA", "FECHA DE INICIO", "HORA DE INICIO", "ZONA DE ESTACIÓN", "N° REGISTRO DE FALLA",
+])
+DEDUP_PAGE_SIZE = 50              # tarjetas por página (allCards)
+DEDUP_MIN_REFRESH_SEC = 60        # no consultar cambios más seguido que esto
+DEDUP_FULL_REFRESH_SEC = 3600     # reconstrucción completa (detecta tarjetas borradas)
+
+class PipefyQueryError(RuntimeError):
+    """Una consulta a Pipefy falló (HTTP o errores GraphQL)."""
+
+def fetch_cards_page(token: str, pipe_id: int, after: str | None = None, updated_since: str | None = None):
+    """Una página de `allCards`: `(nodos, hay_más, cursor)`."""
+    q = {
+        "query": """
+        query($pipe: ID!, $first: Int, $after: String, $filter: AllCardsFilter) {
+          allCards(pipeId: $pipe, first: $first, after: $after, filter: $filter) {
+            pageInfo { hasNextPage endCursor }
+            edges { node { id fields { field { id } value } } }
+          }
+        }
+        """,
+        "variables": {
+            "pipe": pipe_id, "first": DEDUP_PAGE_SIZE, "after": after,
+            "filter": {"field": "updated_at", "operator": "gte", "value": updated_since} if updated_since else None,
+        },
+    }
+    resp = get_pipefy_client(token).post(q, timeout=60, op="all_cards")
+    if resp.status_code != 200: raise PipefyQueryError(f"HTTP {resp.status_code}: {resp.text[:300]}")
+    data = resp.json()
+    if data.get("errors"): raise PipefyQueryError(str(data["errors"]))
+    conn = data["data"]["allCards"]
+    return [e["node"] for e in conn["edges"]], conn["pageInfo"]["hasNextPage"], conn["pageInfo"]["endCursor"]
+
+def natural_keys(df: pd.DataFrame, columns: list | tuple = DEDUP_KEY_COLUMNS) -> list[tuple | None]:
+    """Clave natural por fila (textos normalizados; fechas/horas en formato canónico).
+    None si todas sus partes están vacías."""
+    kinds = {f.column: f.kind for f in COMPILED_FIELDS}
+    parts = []
+    for c in columns:
+        if c not in df.columns:
+            parts.append([None] * len(df))
+            continue
+        col = _first_col(df, c)
+        if kinds.get(c) in ("date", "time"): col = normalize_temporal(col, kinds[c])[0]
+        codes, texts = _text_codes(col)
+        lut = [" ".join(t.split()).casefold() if t is not None else None for t in texts] + [None]
+        parts.append([lut[k] for k in codes])
+    return [key if any(key) else None for key in zip(*parts)]
+
+class PipeCardIndex:
+    """Índice en memoria `clave natural -> id de tarjeta` de un pipe.
+
+    Se llena paginando `allCards` con cursor y después se actualiza solo con las
+    tarjetas modificadas desde la última sincronización."""
+
+    def __init__(self, pipe_id: int, columns: tuple):
+        self.pipe_id = pipe_id
+        self.columns = tuple(columns)
+        field_ids = {f.column: f.field_id for f in COMPILED_FIELDS}
+        self._field_ids = {c: field_ids[c] for c in self.columns if c in field_ids}
+        self._cards = {}          # card_id -> clave natural
+        self._by_key = {}
+        self._synced_at = None    # datetime UTC del inicio de la última sincronización
+        self._full_at = 0.0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _cards_frame(self, nodes) -> pd.DataFrame:
+        rows = []
+        for node in nodes:
+            values = {(f.get("field") or {}).get("id"): f.get("value") for f in node.get("fields") or []}
+            rows.append({c: values.get(fid) for c, fid in self._field_ids.items()})
+        return pd.DataFrame(rows, columns=list(self._field_ids), dtype=object)
+
+    def refresh(self, token: str, force_full: bool = False):
+        with self._lock:
+            now = time.time()
+            full = force_full or self._synced_at is None or now - self._full_at > DEDUP_FULL_REFRESH_SEC
+            if not full and now - self._checked_at < DEDUP_MIN_REFRESH_SEC: return
+            started = datetime.now(timezone.utc)
+            # Margen de 5 min por diferencias de reloj con el servidor
+            since = None if full else (self._synced_at - pd.Timedelta(minutes=5)).isoformat()
+            cards = {} if full else dict(self._cards)
+            after, more = None, True
+            while more:
+                nodes, more, after = fetch_cards_page(token, self.pipe_id, after, since)
+                if not nodes: break
+                keys = natural_keys(self._cards_frame(nodes), self.columns)
+                for node, key in zip(nodes, keys): cards[node["id"]] = key
+            by_key = {}
+            for card_id, key in cards.items():
+                if key is not None: by_key.setdefault(key, card_id)
+            self._cards, self._by_key = cards, by_key
+            self._synced_at, self._checked_at = started, now
+            if full: self._full_at = now
+
+    def lookup(self, keys: list) -> list:
+        """Id de la tarjeta existente para cada clave (o None)."""
+        by_key = self._by_key
+        return [by_key.get(k) if k is not None else None for k in keys]
+
+@functools.lru_cache(maxsize=None)
+def get_card_index(pipe_id: int, columns: tuple = tuple(DEDUP_KEY_COLUMNS)) -> PipeCardIndex:
+    """Un índice por pipe (y clave), compartido entre sesiones."""
+    return PipeCardIndex(pipe_id, columns)
+
+def find_existing_cards(df: pd.DataFrame, token: str, pipe_id: int) -> list:
+    """Refresca el índice del pipe y devuelve, por fila de `df`, el id de la tarjeta que ya existe."""
+    index = get_card_index(pipe_id)
+    index.refresh(token)
+    return index.lookup(natural_keys(df, index.columns))
+
+# =============== Trabajos de subida en segundo plano ===============
+UPLOAD_MAX_JOBS = int(str(get_secret("UPLOAD_MAX_JOBS", "2")) or "2")  # trabajos simultáneos en el servidor
+UPLOAD_JOB_HISTORY = 50                                                # trabajos terminados que se conservan
+UPLOAD_UI_REFRESH_SEC = float(str(get_secret("UPLOAD_UI_REFRESH_SEC", "1.0")) or "1.0")  # refresco del avance en la UI
+ERROR_COLUMNS = ["fila", "EMPRESA", "estado_http", "mensaje"]
+
+class UploadJob:
+    """Estado de un trabajo de subida; lo actualiza el worker y lo lee la UI."""
+
+    def __init__(self, user: str, pipe_id: int, filename: str, total: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.user = user
+        self.pipe_id = pipe_id
+        self.filename = filename
+        self.total = total
+        self.processed = self.creadas = self.errores = 0
+        self.errors = []            # dicts con ERROR_COLUMNS
+        self.cards = []             # (fila, card_id)
+        self.missing_labels = set()
+        self.status = "queued"      # queued | running | finished | failed
+        self.message = ""
+        self.created_at = time.time()
+        self.first_card_at = None
+        self.finished_at = None
+        # Modo streaming: lo que en el modo normal se ve antes de subir se acumula aquí
+        self.streaming = False
+        self.rows_read = self.queued = self.skipped_done = 0
+        self.not_sent = 0           # filas inválidas u omitidas (cuentan como procesadas)
+        self.invalid_rows = []      # {"fila", "faltan"}
+        self.unparsed = []          # {"fila", "columna", "valor"}
+        self.skipped_existing = []  # (fila, card_id)
+        self.rejected = []          # {"fila", "campo", "valor", "motivo"} (pre-validación)
+        self._exports = None        # (n_errores, frame, csv, xlsx) ya armados
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def errors_frame(self) -> pd.DataFrame:
+        """Errores por fila como tabla (`ERROR_COLUMNS`), ordenada por fila."""
+        df = pd.DataFrame(list(self.errors), columns=ERROR_COLUMNS)
+        df["estado_http"] = df["estado_http"].astype("Int64")
+        return df.sort_values("fila", kind="stable", ignore_index=True)
+
+    def errors_exports(self) -> tuple[pd.DataFrame, bytes, bytes]:
+        """`(errors_frame, CSV utf-8-sig, XLSX)`, armados una vez y reutilizados en cada
+        rerun mientras no lleguen errores nuevos."""
+        n = len(self.errors)
+        if self._exports is None or self._exports[0] != n:
+            df = self.errors_frame()
+            bio = io.BytesIO()
+            df.to_excel(bio, index=False, sheet_name="Errores")
+            self._exports = (len(df), df, df.to_csv(index=False).encode("utf-8-sig"), bio.getvalue())
+        return self._exports[1:]
+
+def run_upload_job(job: UploadJob, token: str, df_enviar: pd.DataFrame, keys: list, titles: list,
+                   filas: list, journal: UploadJournal):
+    """Sube `df_enviar` registrando cada resultado en la bitácora y en `job`.
+    `filas` es el número de fila (para reportes) de cada fila de `df_enviar`."""
+    metrics = get_metrics()
+    job.status = "running"
+    try:
+        labels_map = {}
+        if needs_labels(df_enviar):  # sin etiquetas en el archivo, una caída de esa consulta no frena la subida
+            with metrics.timer("labels"):
+                labels_map = get_labels_cache().get(token, job.pipe_id)
+        missing = []
+        empresas = _to_text(_first_col(df_enviar, "EMPRESA")) if "EMPRESA" in df_enviar.columns else [None] * len(df_enviar)
+        journal.mark_pending(job.pipe_id, keys)
+        with metrics.timer("payload_build", rows=len(df_enviar)):
+            payloads = build_payloads(df_enviar, labels_map, missing)
+        with metrics.timer("upload") as t:
+            for i, (ok, info) in enumerate(upload_cards(zip(payloads, titles), token, job.pipe_id)):
+                _record_result(job, journal, keys[i], filas[i], empresas[i], ok, info)
+                job.processed = t.rows = i + 1
+        job.missing_labels.update(missing)
+        job.status = "finished"
+    except Exception as e:
+        job.status, job.message = "failed", str(e)
+    finally:
+        job.finished_at = time.time()
+
+def _record_result(job: UploadJob, journal: UploadJournal, key: str, fila, empresa, ok: bool, info):
+    """Registra el resultado de una fila en la bitácora, en `job` y en las métricas."""
+    journal.record(job.pipe_id, key, ok, info)
+    if ok:
+        job.creadas += 1
+        job.cards.append((fila, info))
+    else:
+        job.errores += 1
+        job.errors.append({"fila": fila, "EMPRESA": empresa,
+                           "estado_http": getattr(info, "status", None), "mensaje": str(info)})
+    get_metrics().inc("siot_cards_total", result="created" if ok else "failed")
+    if job.first_card_at is None: _first_card(job)
+
+def _first_card(job: UploadJob):
+    job.first_card_at = time.time()
+    get_metrics().observe("siot_first_card_seconds", job.first_card_at - job.created_at)
+
+class UploadWorker:
+    """Pool de subidas propio del servidor: los trabajos siguen aunque la sesión se recargue
+    o se desconecte. Todos comparten el `PipefyClient` (tasa y concurrencia globales)."""
+
+    def __init__(self, max_jobs: int = UPLOAD_MAX_JOBS):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_jobs)), thread_name_prefix="siot-upload")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, job: UploadJob, *args, target=None) -> str:
+        """Encola `target(job, *args)` (por defecto `run_upload_job`)."""
+        with self._lock:
+            self._jobs[job.id] = job
+            done = [j for j in self._jobs.values() if not j.active]
+            for old in done[:max(0, len(done) - UPLOAD_JOB_HISTORY)]:
+                self._jobs.pop(old.id, None)
+        self._pool.submit(target or run_upload_job, job, *args)
+        return job.id
+
+    def get(self, job_id: str) -> UploadJob | None:
+        with self._lock: return self._jobs.get(job_id)
+
+    def jobs_for(self, user: str) -> list[UploadJob]:
+        with self._lock: return [j for j in reversed(self._jobs.values()) if j.user == user]
+
+@functools.lru_cache(maxsize=None)
+def get_upload_worker() -> UploadWorker:
+    return UploadWorker()
+
+# =============== Reglas de obligatoriedad ===============
+REQUIRED_COLS = [
+    "CCU",
+    "INTEGRANTES DE CUADRILLA",
+    "CONTACTO CCU",
+    "ZONA DE ESTACIÓN",
+    "FECHA DE INICIO",
+    "FECHA DE FIN",
+    "HORA DE INICIO",
+    "HORA DE FIN",
+    "N° REGISTRO DE FALLA",
+    "VEHÍCULO",
+    "ILUMINACIÓN PARCIAL",
+    "SEÑALETICA PROPIA",
+    "CORREO DEL SOLICITANTE",
+]
+
+# =============== Preparación (lectura + alias + validación) ===============
+def _empresa_mask(df: pd.DataFrame) -> pd.Series:
+    return df["EMPRESA"].astype(str).str.strip().replace({"None": "", "nan": ""}) != ""
+
+def trim_to_last_empresa(df: pd.DataFrame) -> pd.DataFrame:
+    """Corta hasta la última fila con EMPRESA no vacía (si existe la columna)."""
+    if "EMPRESA" in df.columns:
+        mask_emp = _empresa_mask(df)
+        if mask_emp.any():
+            df = df.loc[df.index.min(): df.index[mask_emp].max()].copy()
+    return df
+
+def _empty_mask(col: pd.Series) -> pd.Series:
+    """Celdas vacías de una columna: NaN/None o texto en blanco."""
+    if not (pd.api.types.is_object_dtype(col.dtype) or pd.api.types.is_string_dtype(col.dtype)):
+        return col.isna()
+    # Se evalúa el blanco solo sobre los valores únicos; el código -1 (NaN) cae en el True final
+    codes, uniques = pd.factorize(col, use_na_sentinel=True)
+    blank = np.fromiter((isinstance(u, str) and not u.strip() for u in uniques), bool, len(uniques))
+    return pd.Series(np.append(blank, True)[codes], index=col.index)
+
+def _first_col(df: pd.DataFrame, name) -> pd.Series:
+    """`df[name]`; con encabezados duplicados vale la primera aparición."""
+    col = df.loc[:, name]
+    return col.iloc[:, 0] if isinstance(col, pd.DataFrame) else col
+
+def validate_required(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]:
+    """Devuelve `(faltantes_por_fila, valid_mask)` según REQUIRED_COLS.
+
+    Se calcula por columnas (sin iterar filas) y el resultado queda alineado al
+    índice de `df`, empiece donde empiece."""
+    cols = [c for c in REQUIRED_COLS if c in df.columns]
+    if not cols or df.empty:
+        return pd.DataFrame(columns=["fila", "faltan"]), pd.Series(True, index=df.index)
+    missing = pd.DataFrame({c: _empty_mask(_first_col(df, c)) for c in cols}, index=df.index)
+    valid_mask = ~missing.any(axis=1)
+    bad = missing[~valid_mask]
+    faltan = bad.dot(pd.Index(cols) + ", ").str[:-2]
+    faltantes_por_fila = pd.DataFrame({
+        "fila": row_numbers(bad.index),
+        "faltan": faltan.to_numpy(),
+    })
+    return faltantes_por_fila, valid_mask
+
+def prepare_dataframe(content: bytes, table_name: str = "SIOT"):
+    """read → alias → recorte → fechas → validación, sin caché (ver `prepare_upload`)."""
+    metrics = get_metrics()
+    df = read_excel_table_siot(content, table_name)
+    if df.empty:
+        return (df, pd.DataFrame(columns=["fila", "faltan"]), pd.Series(dtype=bool),
+                pd.DataFrame(columns=["fila", "columna", "valor"]))
+    with metrics.timer("aliases", rows=len(df)):
+        df = trim_to_last_empresa(apply_aliases(df))
+    return normalize_and_validate(df)
+
+def normalize_and_validate(df: pd.DataFrame):
+    """fechas → validación de un DataFrame ya con alias: `(df, faltantes, valid_mask, fechas_invalidas)`."""
+    metrics = get_metrics()
+    with metrics.timer("dates", rows=len(df)):
+        df, fechas_invalidas = normalize_temporal_columns(df)
+    with metrics.timer("validation", rows=len(df)):
+        faltantes_por_fila, valid_mask = validate_required(df)
+    return df, faltantes_por_fila, valid_mask, fechas_invalidas
+
+# =============== Caché de archivos procesados ===============
+PARSE_CACHE_ENTRIES = int(str(get_secret("PARSE_CACHE_ENTRIES", "8")) or "8")
+PARSE_CACHE_DIR     = str(get_secret("PARSE_CACHE_DIR", "") or "")  # vacío = sin volcado a disco
+
+class ParsedCache:
+    """LRU en memoria de resultados ya normalizados, con volcado opcional a disco.
+
+    Al desalojar una entrada de memoria se guarda en `spill_dir` (si se configuró),
+    de donde se recupera en un acierto posterior."""
+
+    def __init__(self, max_entries: int = PARSE_CACHE_ENTRIES, spill_dir: str = PARSE_CACHE_DIR):
+        self.max_entries = max(1, int(max_entries))
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        if self.spill_dir: self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{key}.pkl"
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        if not self.spill_dir: return None
+        try:
+            with open(self._spill_path(key), "rb") as f: value = pickle.load(f)
+        except Exception:
+            return None
+        self.put(key, value)
+        return value
+
+    def put(self, key: str, value):
+        evicted = []
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                evicted.append(self._mem.popitem(last=False))
+        if self.spill_dir:
+            for k, v in evicted: self._spill(k, v)
+
+    def _spill(self, key: str, value):
+        try:
+            tmp = self._spill_path(key).with_suffix(".tmp")
+            with open(tmp, "wb") as f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._spill_path(key))
+            # Acota el disco: conserva los más recientes
+            files = sorted(self.spill_dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime, reverse=True)
+            for old in files[self.max_entries * 4:]: old.unlink(missing_ok=True)
+        except Exception:
+            pass
+
+@functools.lru_cache(maxsize=None)
+def get_parse_cache() -> ParsedCache:
+    """Caché compartida por todas las sesiones del servidor."""
+    return ParsedCache()
+
+def _config_fingerprint() -> str:
+    cfg = [ALIASES, REQUIRED_COLS, FIELD_SPEC]
+    return hashlib.sha256(json.dumps(cfg, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def _parse_key(content: bytes, table_name: str) -> str:
+    h = hashlib.sha256(content)
+    h.update(table_name.encode("utf-8"))
+    h.update(_config_fingerprint().encode("ascii"))
+    return h.hexdigest()
+
+def prepare_upload(content: bytes, table_name: str = "SIOT"):
+    """Lee, normaliza y valida el Excel: `(df, faltantes_por_fila, valid_mask, fechas_invalidas)`.
+
+    Memoizado por hash del contenido + configuración de alias, así los reruns de
+    Streamlit (p.ej. al pulsar "Subir") no vuelven a parsear el archivo.
+    El resultado es compartido: no modificarlo in-place."""
+    key = _parse_key(content, table_name)
+    cache = get_parse_cache()
+    hit = cache.get(key)
+    get_metrics().inc("siot_parse_cache_total", result="hit" if hit is not None else "miss")
+    if hit is not None: return hit
+    result = prepare_dataframe(content, table_name)
+    cache.put(key, result)
+    return result
+
+def prepared_row_keys(content: bytes, pipe_id: int, table_name: str = "SIOT") -> list[str]:
+    """`row_keys` de las filas válidas de `prepare_upload`, memoizadas por archivo y pipe
+    en la misma caché (no se recalculan en cada rerun). No modificar la lista devuelta."""
+    key = f"{_parse_key(content, table_name)}-keys-{int(pipe_id)}"
+    cache = get_parse_cache()
+    hit = cache.get(key)
+    if hit is not None: return hit
+    df, _, valid_mask, _ = prepare_upload(content, table_name)
+    keys = row_keys(df[valid_mask], pipe_id)
+    cache.put(key, keys)
+    return keys
+
+# =============== Modo streaming (por bloques) ===============
+# Alternativa opcional a prepare_upload + run_upload_job: las filas pasan en bloques por
+# lectura → alias → recorte → fechas/validación → mapeo → envío, con colas acotadas entre
+# etapas. La subida empieza con el primer bloque y la memoria no crece con el libro.
+STREAM_CHUNK_ROWS = int(str(get_secret("STREAM_CHUNK_ROWS", "1000")) or "1000")
+STREAM_QUEUE_CHUNKS = 2  # bloques listos en espera entre dos etapas
+
+def _threaded(gen, maxsize: int = STREAM_QUEUE_CHUNKS, name: str = "siot-stream"):
+    """Corre el generador `gen` en otro hilo y entrega sus elementos por una cola acotada,
+    así la etapa siguiente trabaja mientras esta produce. Los errores se relanzan aquí."""
+    q = queue.Queue(maxsize=max(1, int(maxsize)))
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run():
+        try:
+            for item in gen:
+                if not _put(("item", item)): return
+            _put(("end", None))
+        except BaseException as e:
+            _put(("error", e))
+        finally:
+            gen.close()
+
+    threading.Thread(target=_run, name=name, daemon=True).start()
+    try:
+        while True:
+            kind, val = q.get()
+            if kind == "end": return
+            if kind == "error": raise val
+            yield val
+    finally:
+        stop.set()  # si quien consume abandona, el productor deja de leer
+
+def table_row_count(content: bytes, table_name: str = "SIOT") -> int | None:
+    """Filas de datos declaradas por la tabla (sin leer las celdas); None si no existe."""
+    found = _find_table_ref(io.BytesIO(content), table_name)
+    if not found: return None
+    _, min_row, _, max_row = range_boundaries(found[1])
+    return max(0, max_row - min_row)
+
+def iter_source_chunks(content: bytes, table_name: str = "SIOT", chunk_size: int = STREAM_CHUNK_ROWS):
+    """Bloques de la tabla ya con alias; sin tabla, los del fallback por encabezado."""
+    for source in (iter_table_chunks(content, table_name, chunk_size), iter_header_chunks(content, chunk_size)):
+        got = False
+        for chunk in source:
+            got = True
+            with get_metrics().timer("aliases", rows=len(chunk)):
+                yield apply_aliases(chunk)
+        if got: return
+
+def trim_stream(chunks):
+    """`trim_to_last_empresa` por bloques: las filas sin EMPRESA se retienen hasta que
+    aparece una posterior con EMPRESA; las que quedan al final se descartan. Si ninguna
+    fila tiene EMPRESA no se recorta nada (igual que la versión completa)."""
+    held, any_empresa = [], False
+    for df in chunks:
+        if "EMPRESA" not in df.columns:
+            yield df
+            continue
+        mask = _empresa_mask(df)
+        if not mask.any():
+            held.append(df)
+            continue
+        any_empresa = True
+        last = df.index[mask].max()
+        head = df[df.index <= last]
+        yield pd.concat(held + [head]) if held else head
+        rest = df[df.index > last]
+        held = [rest] if len(rest) else []
+    if not any_empresa:
+        yield from held
+
+def _stream_prepared(job: UploadJob, content: bytes, table_name: str):
+    """Etapa de lectura: bloques recortados, normalizados y validados."""
+    for df in trim_stream(iter_source_chunks(content, table_name)):
+        if df.empty: continue
+        df, faltantes, valid_mask, fechas = normalize_and_validate(df)
+        job.rows_read += len(df)
+        job.invalid_rows.extend(faltantes.to_dict("records"))
+        job.unparsed.extend(fechas.to_dict("records"))
+        yield df, valid_mask
+
+def _stream_mapped(job: UploadJob, prepared, token: str, journal: UploadJournal, labels_map: dict | None,
+                   missing: list, retry_failed_only: bool, skip_existing: bool, schema: dict | None = None):
+    """Etapa de mapeo: por bloque, filtra lo ya subido (bitácora), lo que el formulario
+    rechazaría (`schema`) y, opcionalmente, lo que ya existe en el pipe; marca pendientes y
+    arma los payloads. Entrega una lista de filas a enviar. Con `labels_map=None` las
+    etiquetas del pipe se consultan recién con el primer bloque que las use."""
+    seen, n_valid = {}, 0
+    index = None
+    if skip_existing:
+        index = get_card_index(job.pipe_id)
+        index.refresh(token)
+    for df, valid_mask in prepared:
+        df_validas = df[valid_mask]
+        job.not_sent += int((~valid_mask).sum())
+        if df_validas.empty: continue
+        existentes = index.lookup(natural_keys(df_validas, index.columns)) if index is not None else None
+        sel = select_rows(df_validas, job.pipe_id, journal, seen=seen, schema=schema, existentes=existentes)
+        keys, filas = sel.keys, sel.filas
+        job.skipped_done += sel.estados.count("done")
+        if sel.rechazos is not None: job.rejected.extend(sel.rechazos.to_dict("records"))
+        job.skipped_existing.extend((filas[p], cid) for p, cid in sel.duplicados)
+        pos = sel.positions(retry_failed_only)
+        job.not_sent += len(df_validas) - len(pos)
+        titles = build_titles(df_validas, start=n_valid + 1)
+        n_valid += len(df_validas)
+        if not pos: continue
+        enviar = df_validas.iloc[pos]
+        if labels_map is None and needs_labels(enviar):
+            with get_metrics().timer("labels"):
+                labels_map = get_labels_cache().get(token, job.pipe_id)
+        with get_metrics().timer("payload_build", rows=len(enviar)):
+            payloads = build_payloads(enviar, labels_map or {}, missing)
+        empresas = _to_text(_first_col(enviar, "EMPRESA")) if "EMPRESA" in enviar.columns else [None] * len(enviar)
+        batch = [(payloads[j], titles[p], keys[p], filas[p], empresas[j]) for j, p in enumerate(pos)]
+        journal.mark_pending(job.pipe_id, [b[2] for b in batch])
+        job.queued += len(batch)
+        yield batch
+
+def run_streaming_upload_job(job: UploadJob, token: str, content: bytes, journal: UploadJournal,
+                             table_name: str = "SIOT", retry_failed_only: bool = False,
+                             skip_existing: bool = False, prevalidate_rows: bool = True):
+    """Como `run_upload_job`, pero leyendo el Excel por bloques mientras se sube.
+
+    `job.total` arranca con las filas declaradas por la tabla y `job.processed` cuenta
+    filas resueltas (enviadas, omitidas o inválidas). Los números de fila de errores y
+    omisiones son los de la tabla. Con `prevalidate_rows` las filas que el formulario de
+    inicio rechazaría no se envían y quedan en `job.rejected`."""
+    metrics = get_metrics()
+    job.streaming = True
+    job.status = "running"
+    try:
+        job.total = table_row_count(content, table_name) or 0
+        schema = None
+        if prevalidate_rows:
+            with metrics.timer("form_schema"):
+                schema = get_form_schema(token, job.pipe_id)
+        missing = []
+        prepared = _threaded(_stream_prepared(job, content, table_name), name="siot-stream-read")
+        mapped = _threaded(_stream_mapped(job, prepared, token, journal, None, missing,
+                                          retry_failed_only, skip_existing, schema), name="siot-stream-map")
+        meta = deque()
+
+        def _jobs():
+            for batch in mapped:
+                for payload, title, key, fila, empresa in batch:
+                    meta.append((key, fila, empresa))
+                    yield payload, title
+
+        with metrics.timer("upload") as t:
+            for i, (ok, info) in enumerate(upload_cards(_jobs(), token, job.pipe_id)):
+                _record_result(job, journal, *meta.popleft(), ok, info)
+                t.rows = i + 1
+                job.processed = t.rows + job.not_sent
+                job.total = max(job.total, job.processed)
+        job.processed = job.total = job.rows_read
+        job.missing_labels.update(missing)
+        job.status = "finished"
+    except Exception as e:
+        job.status, job.message = "failed", str(e)
+    finally:
+        job.finished_at = time.time()